@@ -1,6 +1,26 @@
-from .gum import chafa, evaluate, display, display_file, restart, display as D, GumError, GumErrorType
-from .utl import Var, Con, Element, DisplayMixin, DataGroup, Group, stringify
+from .gum import chafa, evaluate, evaluate_many, evaluate_async, display, display_file, prewarm, restart, set_debug, set_workers, set_timeout, set_cache, cache_info, put_data, drop_data, stats, reset_stats, add_hook, remove_hook, connect, display as D, GumError, GumErrorType, GumPool, AsyncGumPipe
+from .srv import GumSocketClient
+from .utl import Var, Con, Expr, Element, DisplayMixin, DataGroup, Group, stringify, set_precision
 from .gen import V, C, GumData
-from .viz import lines, points, bars, test_data
-from .dem import demo
 from . import gen as G
+
+# plotting and demo helpers are loaded on first use
+LAZY = {
+    'lines': 'viz',
+    'points': 'viz',
+    'bars': 'viz',
+    'test_data': 'viz',
+    'demo': 'dem',
+}
+
+# submodules that were bound on import before they went lazy
+SUBMODULES = [ 'viz', 'dem' ]
+
+def __getattr__(name):
+    from importlib import import_module
+    if name in SUBMODULES:
+        return import_module(f'.{name}', __name__)
+    if name in LAZY:
+        module = import_module(f'.{LAZY[name]}', __name__)
+        return getattr(module, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
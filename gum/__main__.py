@@ -4,6 +4,9 @@ import sys
 import argparse
 from .dem import demo
 from .gum import display
+from .srv import serve
+from .web import serve_http
+from .render import render_files, print_summary
 
 if __name__ == '__main__':
     # parse command line arguments
@@ -11,8 +14,47 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--demo', type=str, help='the demo to run', default=None)
     parser.add_argument('-s', '--size', type=int, help='the size of the display', default=50)
     parser.add_argument('-t', '--theme', type=str, help='the theme to use', default='dark')
+    commands = parser.add_subparsers(dest='command')
+
+    # shared render server
+    parser_serve = commands.add_parser('serve', help='run a render server on a unix socket')
+    parser_serve.add_argument('--socket', type=str, help='the socket path', default=None)
+    parser_serve.add_argument('--workers', type=int, help='the number of node workers', default=None)
+
+    # http render service
+    parser_http = commands.add_parser('http', help='run an http render service')
+    parser_http.add_argument('--host', type=str, help='the address to bind', default='127.0.0.1')
+    parser_http.add_argument('--port', type=int, help='the port to listen on', default=8080)
+    parser_http.add_argument('--workers', type=int, help='the number of node workers', default=None)
+    parser_http.add_argument('--queue', type=int, help='requests allowed to wait before returning 503', default=64)
+    parser_http.add_argument('--timeout', type=float, help='render deadline in seconds', default=30)
+    parser_http.add_argument('--cache', type=int, help='rendered svgs kept in memory', default=256)
+
+    # batch rendering
+    parser_render = commands.add_parser('render', help='render jsx files to svg')
+    parser_render.add_argument('inputs', type=str, nargs='+', help='files, directories, or globs')
+    parser_render.add_argument('-o', '--output', type=str, help='the output directory', default=None)
+    parser_render.add_argument('-j', '--jobs', type=int, help='the number of node workers', default=None)
+    parser_render.add_argument('--pixels', type=int, help='the render size', default=500)
+    parser_render.add_argument('--theme', type=str, help='the theme to use', default=None)
+    parser_render.add_argument('--timeout', type=float, help='render deadline in seconds', default=None)
+    parser_render.add_argument('--force', action='store_true', help='render even if unchanged')
+    parser_render.add_argument('-v', '--verbose', action='store_true', help='print each file as it finishes')
     args = parser.parse_args()
 
     # dispatch commands
-    elem = demo(args.demo) if args.demo is not None else sys.stdin.read()
-    display(elem, size=args.size, theme=args.theme)
+    if args.command == 'serve':
+        serve(args.socket, args.workers)
+    elif args.command == 'http':
+        serve_http(args.host, args.port, args.workers, args.queue, args.timeout, args.cache)
+    elif args.command == 'render':
+        log = (lambda src, dst, seconds, error: print(dst if error is None else f'{src}: failed', flush=True)) if args.verbose else None
+        summary = render_files(
+            args.inputs, output=args.output, jobs=args.jobs, pixels=args.pixels,
+            theme=args.theme, timeout=args.timeout, force=args.force, log=log,
+        )
+        print_summary(summary)
+        sys.exit(1 if summary['failed'] > 0 else 0)
+    else:
+        elem = demo(args.demo) if args.demo is not None else sys.stdin.read()
+        display(elem, size=args.size, theme=args.theme)
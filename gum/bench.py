@@ -0,0 +1,258 @@
+# benchmark suite
+
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+
+from . import gum as server
+from .gum import serialize, percentile, new_timing, gum_version, GumError, GumUnixPipe
+from .dem import DEMOS
+from . import gen as G
+from . import viz
+
+##
+## scenarios
+##
+
+# rows for the scaled data scenarios
+SIZES = [ 1_000, 100_000, 1_000_000 ]
+
+# columns for the wide frame scenarios
+WIDTHS = [ 50, 500 ]
+
+# nesting levels for the deep layout scenarios
+DEPTHS = [ 10, 50, 200 ]
+
+def bar_data(n):
+    import numpy as np
+    import pandas as pd
+    return pd.Series(np.random.randint(1, 10, n), index=[ f'b{i}' for i in range(n) ], name='value')
+
+def deep_layout(depth):
+    elem = G.Rect(rounded=True)
+    for i in range(depth):
+        Stack = G.HStack if i % 2 == 0 else G.VStack
+        elem = Stack(elem, G.Square(), spacing=True)
+    return G.Frame(elem, padding=True)
+
+def with_data(plot, make, *args, **kwargs):
+    # data is generated once, the figure is rebuilt from it each round
+    def setup():
+        data = make(*args, **kwargs)
+        return lambda: plot(data)
+    return setup
+
+def scenarios(sizes=SIZES):
+    # each maps a name to (rows, setup), where setup returns a figure builder
+    cases = {}
+
+    # stock demos
+    for name, func in DEMOS.items():
+        cases[f'demo/{name}'] = (None, lambda func=func: func)
+
+    # scaled data
+    for n in sizes:
+        cases[f'lines/{n}'] = (n, with_data(viz.lines, viz.test_data, 'brown', T=n))
+        cases[f'points/{n}'] = (n, with_data(viz.points, viz.test_data, 'brown', T=n))
+        cases[f'bars/{n}'] = (n, with_data(viz.bars, bar_data, n))
+
+    # wide frames
+    for k in WIDTHS:
+        cases[f'wide/{k}'] = (1_000 * k, with_data(viz.lines, viz.test_data, 'brown', T=1_000, L=k))
+
+    # deep layouts
+    for d in DEPTHS:
+        cases[f'deep/{d}'] = (None, lambda d=d: lambda: deep_layout(d))
+
+    return cases
+
+##
+## measurement
+##
+
+def payload_bytes(code, data):
+    size = len(code.encode())
+    if data is not None:
+        size += sum(v['data'].nbytes if 'dtype' in v else len(json.dumps(v)) for v in data.values())
+    return size
+
+def measure(build, repeat=10, pixels=500):
+    # warm up workers and lazy imports
+    code, data = serialize(build())
+    server.server.evaluate(code, pixels=pixels, data=data)
+
+    # fresh figure each round so memoized serialization doesn't count
+    ser, lat, evals = [], [], []
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        fig = build()
+        t0 = time.perf_counter()
+        code, data = serialize(fig)
+        t1 = time.perf_counter()
+        timing = new_timing()
+        server.server.evaluate(code, pixels=pixels, data=data, timing=timing)
+        t2 = time.perf_counter()
+        ser.append(t1 - t0)
+        lat.append(t2 - t0)
+        evals.append(timing.get('eval', 0.0) + timing.get('svg', 0.0))
+    elapsed = time.perf_counter() - t_start
+
+    lat.sort()
+    return {
+        'serialize': sorted(ser)[len(ser) // 2],
+        'node': sorted(evals)[len(evals) // 2],
+        'p50': percentile(lat, 0.50),
+        'p95': percentile(lat, 0.95),
+        'p99': percentile(lat, 0.99),
+        'throughput': repeat / elapsed,
+        'bytes': payload_bytes(code, data),
+    }
+
+def cold_start(repeat=3):
+    # fresh workers, timed from spawn until the warm-up svg is out
+    samples = []
+    for _ in range(repeat):
+        worker = GumUnixPipe()
+        try:
+            worker.ping()
+        finally:
+            worker.close()
+        if worker.startup is not None:
+            samples.append(worker.startup)
+    if len(samples) == 0:
+        return None
+    median = lambda k: sorted(s.get(k) or 0.0 for s in samples)[len(samples) // 2]
+    return { 'rows': None, 'first_svg': median('first_svg'), 'boot': median('boot'), 'warmup': median('warmup') }
+
+def run(pattern=None, sizes=SIZES, repeat=10, pixels=500, log=None):
+    results = {}
+    for name, (rows, setup) in scenarios(sizes).items():
+        if pattern is not None and re.search(pattern, name) is None:
+            continue
+        try:
+            stats = measure(setup(), repeat=repeat, pixels=pixels)
+        except (GumError, ValueError) as e:
+            stats = { 'error': str(e) }
+        stats['rows'] = rows
+        results[name] = stats
+        if log is not None:
+            log(name, stats)
+    return results
+
+##
+## reporting
+##
+
+# metrics where smaller is better, the rest are larger is better
+LOWER = [ 'serialize', 'node', 'p50', 'p95', 'p99', 'bytes', 'first_svg' ]
+
+HEADER = f'{"scenario":<20} {"rows":>9} {"ser ms":>9} {"node ms":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"ops/s":>9} {"bytes":>11}'
+
+def format_row(name, stats):
+    if 'error' in stats:
+        return f'{name:<20} error: {stats["error"]}'
+    rows = '' if stats['rows'] is None else stats['rows']
+    ms = lambda k: f'{1000 * stats[k]:>9.2f}'
+    return (
+        f'{name:<20} {rows:>9} {ms("serialize")} {ms("node")} {ms("p50")} {ms("p95")} {ms("p99")} '
+        f'{stats["throughput"]:>9.1f} {stats["bytes"]:>11}'
+    )
+
+def format_startup(stats):
+    return (
+        f'cold start: first svg {1000 * stats["first_svg"]:.1f} ms '
+        f'(node boot {1000 * stats["boot"]:.1f} ms, warm-up {1000 * stats["warmup"]:.1f} ms)'
+    )
+
+def compare(results, baseline, threshold=0.1):
+    # relative change per metric, flagging regressions past the threshold
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base is None or 'error' in stats or 'error' in base:
+            continue
+        for key in LOWER + [ 'throughput' ]:
+            old, new = base.get(key), stats.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if key in LOWER else change < -threshold
+            if worse:
+                regressions.append((name, key, old, new, change))
+    return regressions
+
+def save(path, results):
+    meta = {
+        'version': gum_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(path, 'w') as fid:
+        json.dump({ 'meta': meta, 'results': results }, fid, indent=2)
+
+def load(path):
+    with open(path) as fid:
+        return json.load(fid)
+
+##
+## entry point
+##
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m gum.bench')
+    parser.add_argument('-k', '--filter', type=str, help='regex selecting scenarios', default=None)
+    parser.add_argument('-n', '--repeat', type=int, help='timed renders per scenario', default=10)
+    parser.add_argument('-p', '--pixels', type=int, help='render size', default=500)
+    parser.add_argument('--sizes', type=str, help='comma separated row counts', default=None)
+    parser.add_argument('--save', type=str, help='write results to a json baseline', default=None)
+    parser.add_argument('--compare', type=str, help='compare against a json baseline', default=None)
+    parser.add_argument('--threshold', type=float, help='relative change counted as a regression', default=0.1)
+    parser.add_argument('--cold', type=int, help='fresh workers timed to first svg, 0 to skip', default=3)
+    parser.add_argument('--list', action='store_true', help='list scenarios and exit')
+    args = parser.parse_args(argv)
+
+    # pick scenarios
+    sizes = SIZES if args.sizes is None else [ int(s) for s in args.sizes.split(',') ]
+    if args.list:
+        for name in scenarios(sizes):
+            if args.filter is None or re.search(args.filter, name) is not None:
+                print(name)
+        return 0
+
+    # cold start first, before this process has warm workers
+    startup = None
+    if args.cold > 0 and (args.filter is None or re.search(args.filter, 'startup') is not None):
+        startup = cold_start(args.cold)
+        if startup is not None:
+            print(format_startup(startup), flush=True)
+
+    # run and report as we go
+    print(HEADER)
+    log = lambda name, stats: print(format_row(name, stats), flush=True)
+    results = run(args.filter, sizes=sizes, repeat=args.repeat, pixels=args.pixels, log=log)
+    if startup is not None:
+        results['startup'] = startup
+
+    if args.save is not None:
+        save(args.save, results)
+        print(f'saved baseline to {args.save}')
+
+    if args.compare is not None:
+        baseline = load(args.compare)
+        regressions = compare(results, baseline['results'], threshold=args.threshold)
+        print(f'compared against {args.compare} (gum.js {baseline["meta"]["version"]})')
+        for name, key, old, new, change in regressions:
+            print(f'  {name:<20} {key:<10} {old:.4g} -> {new:.4g} ({100 * change:+.1f}%)')
+        if len(regressions) > 0:
+            print(f'{len(regressions)} regressions past {100 * args.threshold:.0f}%')
+            return 1
+        print('no regressions')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,6 @@
 # gum generation
 
-from .utl import Var, Con, Element, Group, DataGroup, RawGroup, DisplayMixin
+from .utl import Var, Con, Expr, Element, Group, DataGroup, RawGroup, DisplayMixin, SCOPE, Scope, join_lines, is_number, scoped_lines
 
 ##
 ## gum constructors
@@ -72,7 +72,9 @@ class Ellipse(Element):
         super().__init__('Ellipse', True, **kwargs)
 
 class Line(DataGroup):
-    def __init__(self, *children, **kwargs):
+    def __init__(self, *children, downsample=None, pixels=500, **kwargs):
+        if downsample is not None and len(children) > 0:
+            children = downsample_points(children, downsample, pixels)
         super().__init__(*children, tag='Line', **kwargs)
 
 class Shape(DataGroup):
@@ -124,7 +126,17 @@ class SymPoints(Group):
         super().__init__(*children, tag='SymPoints', **kwargs)
 
 class SymLine(Element):
-    def __init__(self, *children, **kwargs):
+    def __init__(self, *children, downsample=None, pixels=500, **kwargs):
+        # thinned vars keep their names and stand in for the originals
+        self.thinned = []
+        if downsample is not None and 'xvals' in kwargs and 'yvals' in kwargs:
+            xvals, yvals = kwargs['xvals'], kwargs['yvals']
+            thin = downsample_xy(xvals, yvals, downsample, pixels)
+            for key, source, value in zip(('xvals', 'yvals'), (xvals, yvals), thin):
+                if isinstance(source, Var):
+                    value = Var(source.name, value)
+                    self.thinned.append((source, value))
+                kwargs[key] = value
         super().__init__('SymLine', True, **kwargs)
 
 class SymShape(Element):
@@ -223,22 +235,124 @@ class Slide(Group):
     def __init__(self, *children, **args):
         super().__init__(*children, tag='Slide', **args)
 
+##
+## downsampling
+##
+
+def numeric_axis(x):
+    import numpy as np
+    x = np.asarray(x)
+    if x.dtype.kind in 'mM':
+        return x.view('i8').astype(float)
+    elif x.dtype.kind in 'iufb':
+        return x.astype(float, copy=False)
+    else:
+        return np.arange(len(x), dtype=float)
+
+def minmax_index(x, y, n):
+    import numpy as np
+    N = len(y)
+
+    # one bucket per pixel column, by x if sorted else by position
+    nbins = max(1, n // 2)
+    if np.all(np.diff(x) >= 0):
+        edges = np.searchsorted(x, np.linspace(x[0], x[-1], nbins + 1)[1:-1])
+    else:
+        edges = np.linspace(0, N, nbins + 1).astype(int)[1:-1]
+    starts = np.unique(np.concatenate([ [ 0 ], edges ]))
+    starts = starts[starts < N]
+    sizes = np.diff(np.append(starts, N))
+
+    # locate first min and max in each bucket
+    def first_match(vals):
+        hits = np.flatnonzero(y == np.repeat(vals, sizes))
+        if len(hits) == 0:
+            return hits
+        return hits[np.minimum(np.searchsorted(hits, starts), len(hits) - 1)]
+    imin = first_match(np.fmin.reduceat(y, starts))
+    imax = first_match(np.fmax.reduceat(y, starts))
+
+    # keep endpoints and sort
+    return np.unique(np.concatenate([ [ 0, N - 1 ], imin, imax ]))
+
+def lttb_index(x, y, n):
+    import numpy as np
+    N = len(y)
+
+    # n - 2 buckets between the fixed endpoints
+    edges = np.linspace(1, N - 1, n - 1).astype(int)
+    sizes = np.diff(edges)
+    avgx = np.add.reduceat(x[:N-1], edges[:-1]) / sizes
+    avgy = np.add.reduceat(y[:N-1], edges[:-1]) / sizes
+    avgx, avgy = np.append(avgx, x[-1]), np.append(avgy, y[-1])
+
+    # pick the point making the largest triangle with its neighbors
+    index = np.empty(n, dtype=int)
+    index[0], index[-1] = 0, N - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i+1]
+        ax, ay = avgx[i+1], avgy[i+1]
+        area = np.abs((x[a] - ax) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ay - y[a]))
+        a = lo + np.argmax(area)
+        index[i+1] = a
+
+    return index
+
+def downsample_index(x, y, method='auto', pixels=500):
+    import numpy as np
+    x, y = numeric_axis(x), np.asarray(y, dtype=float)
+
+    # about two points per pixel
+    n = 2 * pixels
+    if len(y) <= n:
+        return None
+
+    # pick method
+    if method == 'auto':
+        method = 'minmax' if len(y) > 20 * n else 'lttb'
+    if method == 'minmax':
+        return minmax_index(x, y, n)
+    elif method == 'lttb':
+        return lttb_index(x, y, n)
+    else:
+        raise ValueError(f'Unknown downsample method: {method}')
+
+def downsample_xy(xvals, yvals, method='auto', pixels=500):
+    import numpy as np
+    xvals = xvals.value if isinstance(xvals, Var) else xvals
+    yvals = yvals.value if isinstance(yvals, Var) else yvals
+    index = downsample_index(xvals, yvals, method=method, pixels=pixels)
+    if index is None:
+        return xvals, yvals
+    return np.asarray(xvals)[index], np.asarray(yvals)[index]
+
+def downsample_points(points, method='auto', pixels=500):
+    import numpy as np
+    array = np.asarray(points)
+    if array.ndim != 2 or array.shape[1] != 2 or array.dtype.kind not in 'iuf':
+        return points
+    index = downsample_index(array[:, 0], array[:, 1], method=method, pixels=pixels)
+    if index is None:
+        return points
+    return tuple(map(tuple, array[index].tolist()))
+
 ##
 ## dataframe notion
 ##
 
 def ensure_var(var, name=None):
+    # arrays (memmaps too) are held as is, series and indexes without copying
     import numpy as np
-    import pandas as pd
-    if isinstance(var, (np.ndarray, list, tuple)):
-        var = pd.Series(var)
-    elif isinstance(var, pd.Index):
-        var = var.to_series()
-    if isinstance(var, pd.Series):
-        var = Var.from_series(var, name=name)
-    elif not isinstance(var, Var):
-        raise ValueError(f'Unsupported type: {type(var)}')
-    return var
+    if isinstance(var, Var):
+        return var
+    elif isinstance(var, np.ndarray):
+        return Var(name, var)
+    elif isinstance(var, (list, tuple)):
+        return Var(name, np.asarray(var) if all(is_number(v) for v in var) else list(var))
+    elif hasattr(var, 'to_numpy'):
+        return Var.from_series(var, name=name)
+    raise ValueError(f'Unsupported type: {type(var)}')
 
 class GumData:
     def __init__(self, data, index=None):
@@ -250,6 +364,11 @@ class GumData:
         data = [ frame[col] for col in frame ]
         return cls(data, index=frame.index)
 
+    def to_frame(self):
+        import pandas as pd
+        index = pd.Index(self.index.value, name=self.index.name)
+        return pd.DataFrame({ v.name: v.value for v in self._data }, index=index)
+
     def __iter__(self):
         return iter(self._data)
 
@@ -262,13 +381,57 @@ class GumData:
     def __setitem__(self, name, value):
         self._data[name] = ensure_var(value, name=name)
 
+    def variables(self):
+        return [ self.index, *self._data ]
+
     def define(self):
-        return '\n'.join([ v.define() for v in [ self.index, *self._data ] ])
+        return '\n'.join([ v.define() for v in self.variables() ])
 
 ##
 ## top level
 ##
 
+def nested_figures(elem):
+    # figures placed inside the element tree, in document order
+    stack, seen = [ elem ], set()
+    while len(stack) > 0:
+        e = stack.pop()
+        if isinstance(e, Gum):
+            yield e
+            stack.append(e.content)
+        elif isinstance(e, Element) and id(e) not in seen:
+            seen.add(id(e))
+            items = [ *getattr(e, 'children', ()), *e.args.values() ]
+            stack.extend(reversed(items))
+
+def content_refs(elem):
+    # vars used in an element tree and the thinned copies standing in for
+    # others, by the id of the original, leaving nested figures to themselves
+    refs, thinned = set(), {}
+    stack, seen = [ elem ], set()
+    while len(stack) > 0:
+        e = stack.pop()
+        if isinstance(e, Var):
+            refs.add(id(e))
+        elif isinstance(e, Expr):
+            stack.extend(e.args)
+        elif isinstance(e, Element) and id(e) not in seen:
+            seen.add(id(e))
+            for source, var in getattr(e, 'thinned', ()):
+                thinned.setdefault(id(source), []).append(var)
+            stack.extend([ *getattr(e, 'children', ()), *e.args.values() ])
+        elif isinstance(e, (list, tuple)):
+            stack.extend(e)
+        elif isinstance(e, dict):
+            stack.extend(e.values())
+    return refs, thinned
+
+def fresh_name(name, taken):
+    i = 1
+    while f'{name}_{i}' in taken:
+        i += 1
+    return f'{name}_{i}'
+
 class Gum(DisplayMixin):
     def __init__(self, cont, vars=None):
         if vars is None:
@@ -278,9 +441,105 @@ class Gum(DisplayMixin):
         self.vars = vars
         self.content = cont
 
-    def __str__(self):
-        header = '\n'.join([ v.define() for v in self.vars ])
+    def declared(self):
+        # thinned copies replace vars that are only used through them
+        refs, thinned = content_refs(self.content)
+        for v in self.vars:
+            for v1 in (v.variables() if isinstance(v, (GumData, Gum)) else [ v ]):
+                if id(v1) in thinned:
+                    yield from thinned.pop(id(v1))
+                    if id(v1) not in refs:
+                        continue
+                yield v1
+        for vars in thinned.values():
+            yield from vars
+
+    def variables(self):
+        # declared data plus that of nested figures
+        yield from self.declared()
+        for fig in nested_figures(self.content):
+            yield from fig.declared()
+
+    def resolve(self):
+        # emit each distinct array once, alias repeats, rename clashing names
+        entries, renames = [], {}
+        taken, canon, assigned, seen = {}, {}, {}, set()
+        for v in self.variables():
+            if id(v) in seen:
+                continue
+            seen.add(id(v))
+
+            # same name and same data resolve to the same definition
+            digest = v.digest()
+            name = assigned.get((v.name, digest))
+            if name is None:
+                name = v.name
+                if name in taken:
+                    name = fresh_name(name, taken)
+                assigned[(v.name, digest)] = name
+                taken[name] = digest
+                entries.append((name, canon.get(digest, v)))
+                canon.setdefault(digest, name)
+            if name != v.name:
+                renames[id(v)] = name
+
+        scope = Scope(renames) if len(renames) > 0 else None
+        return entries, scope
+
+    def build(self, binary=False):
+        entries, scope = self.resolve()
+
+        # build definitions and content under the renames
+        token = SCOPE.set(scope)
+        try:
+            defs, data = [], {}
+            for name, v in entries:
+                if isinstance(v, str):
+                    defs.append(f'const {name} = {v}')
+                    continue
+                buffer = v.buffer() if binary else None
+                if buffer is None:
+                    defs.append(v.define())
+                else:
+                    data[name] = buffer
+            if isinstance(self.content, Element):
+                body = scoped_lines(scope, self.content.lines())
+            else:
+                body = iter(str(self.content).split('\n'))
+        finally:
+            SCOPE.reset(token)
+
+        return self.header(defs, body), data
+
+    @staticmethod
+    def header(defs, body):
+        # prefix header if needed
+        header = '\n'.join(defs)
         if len(header) > 0:
-            return f'{header}\n\nreturn {self.content}'
-        else:
-            return str(self.content)
+            yield from header.split('\n')
+            yield ''
+            yield f'return {next(body)}'
+        yield from body
+
+    def lines(self):
+        lines, _ = self.build()
+        return lines
+
+    def chunks(self):
+        return join_lines(self.lines())
+
+    def write(self, fp):
+        for chunk in self.chunks():
+            fp.write(chunk)
+
+    def payload(self, stream=False):
+        # numeric arrays are sent as binary buffers
+        lines, data = self.build(binary=True)
+
+        # code as string or stream of chunks
+        chunks = join_lines(lines)
+        code = chunks if stream else ''.join(chunks)
+        return code, (data if len(data) > 0 else None)
+
+    def __str__(self):
+        return '\n'.join(self.lines())
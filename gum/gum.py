@@ -1,10 +1,17 @@
 # terminal tools
 
 import os
+import sys
 import json
+import time
 import base64
+import struct
+import hashlib
+import weakref
 import threading
+import itertools
 import subprocess
+from collections import OrderedDict, deque
 
 ##
 ## chafa interface
@@ -37,6 +44,9 @@ class GumErrorType:
     NOCODE = 'NOCODE'
     NORETURN = 'NORETURN'
     NOELEMENT = 'NOELEMENT'
+    NODATA = 'NODATA'
+    TIMEOUT = 'TIMEOUT'
+    SERVER = 'SERVER'
 
 class GumError(Exception):
     def __init__(self, error_type, error_message):
@@ -44,104 +54,1361 @@ class GumError(Exception):
         self.error_message = error_message
         super().__init__(self.error_message)
 
+##
+## instrumentation
+##
+
+# timed stages, in seconds
+STAGES = [ 'serialize', 'write', 'load', 'eval', 'svg', 'read', 'total' ]
+
+# worker startup, in seconds: node boot, the warm-up render, and spawn to first svg
+STARTUP = [ 'boot', 'warmup', 'first_svg' ]
+
+# recent samples kept per stage for percentiles
+STATS_WINDOW = 4096
+
+def new_timing():
+    return { 'start': time.perf_counter() }
+
+def finish_timing(timing, response, nbytes, read):
+    # merge node side numbers and close the clock
+    timing.update(response.get('timing', {}))
+    timing['read'] = read
+    timing['bytes_in'] = nbytes
+    timing['ok'] = response['ok']
+    timing['total'] = time.perf_counter() - timing.pop('start')
+    render_stats.record(timing)
+    for hook in list(timing_hooks):
+        # hooks run on the reader, which must not die with them
+        try:
+            hook(timing)
+        except Exception as e:
+            print(f'[gum] timing hook {hook!r} failed: {e!r}', file=sys.stderr)
+
+def finish_startup(spawned, response):
+    # the worker says when it's warm, we add the time since spawn
+    startup = dict(response.get('timing', {}))
+    startup['first_svg'] = time.perf_counter() - spawned
+    render_stats.record_startup(startup)
+    return startup
+
+def percentile(values, q):
+    # nearest rank on sorted values
+    index = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[index]
+
+def summarize(samples):
+    # spread of each stage with any samples
+    stages = {}
+    for stage, values in samples.items():
+        if len(values) == 0:
+            continue
+        values = sorted(values)
+        stages[stage] = {
+            'count': len(values),
+            'mean': sum(values) / len(values),
+            'p50': percentile(values, 0.50),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+            'max': values[-1],
+        }
+    return stages
+
+class RenderStats:
+    def __init__(self, window=STATS_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.heap = None
+        self.samples = { s: deque(maxlen=self.window) for s in STAGES }
+        self.startups = { s: deque(maxlen=self.window) for s in STARTUP }
+
+    def record(self, timing):
+        with self.lock:
+            self.count += 1
+            self.errors += not timing.get('ok', True)
+            self.bytes_out += timing.get('bytes_out', 0)
+            self.bytes_in += timing.get('bytes_in', 0)
+            self.heap = timing.get('heap', self.heap)
+            for stage, samples in self.samples.items():
+                if stage in timing:
+                    samples.append(timing[stage])
+
+    def record_startup(self, startup):
+        with self.lock:
+            for stage, samples in self.startups.items():
+                if startup.get(stage) is not None:
+                    samples.append(startup[stage])
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'count': self.count,
+                'errors': self.errors,
+                'bytes_out': self.bytes_out,
+                'bytes_in': self.bytes_in,
+                'heap': self.heap,
+                'stages': summarize(self.samples),
+                'startup': summarize(self.startups),
+            }
+
+# running totals and per request callbacks
+render_stats = RenderStats()
+timing_hooks = []
+
+def stats():
+    return render_stats.snapshot()
+
+def reset_stats():
+    with render_stats.lock:
+        render_stats.reset()
+
+def add_hook(hook):
+    timing_hooks.append(hook)
+
+def remove_hook(hook):
+    if hook in timing_hooks:
+        timing_hooks.remove(hook)
+
 ##
 ## server interface
 ##
 
+def unpack(response):
+    ok, result = response['ok'], response['result']
+    if ok:
+        return result
+    etype = result['error']
+    emsg = result['message']
+    return GumError(etype, emsg)
+
+def serialize(code, stream=False):
+    # split out binary data where supported
+    if hasattr(code, 'payload'):
+        return code.payload(stream=stream)
+    elif stream and hasattr(code, 'chunks'):
+        return code.chunks(), None
+    return str(code), None
+
+# binary data follows the json line, each buffer behind its byte length
+BUFFER_PREFIX = struct.Struct('<Q')
+
+def pack_entry(entry, buffers):
+    # arrays leave the line, leaving their index in the buffers
+    if not isinstance(entry, dict) or 'dtype' not in entry:
+        return entry
+    buffers.append(memoryview(entry['data']).cast('B'))
+    return { 'dtype': entry['dtype'], 'buffer': len(buffers) - 1 }
+
+def pack_data(data, buffers):
+    return { k: pack_entry(v, buffers) for k, v in data.items() }
+
+def pack_buffers(request):
+    # copy of the request without buffers, plus the buffers in order
+    request, buffers = dict(request), []
+    if request.get('cmd') == 'put':
+        if 'data' in request:
+            request['data'] = pack_entry(request['data'], buffers)
+    elif request.get('data') is not None:
+        request['data'] = pack_data(request['data'], buffers)
+    if 'items' in request:
+        request['items'] = [
+            { **i, 'data': pack_data(i['data'], buffers) } if i.get('data') is not None else i
+            for i in request['items']
+        ]
+    if len(buffers) > 0:
+        request['buffers'] = len(buffers)
+    return request, buffers
+
+def data_entries(request):
+    # data entries of a request, in the order pack_buffers walks them
+    if request.get('cmd') == 'put':
+        return [ request['data'] ] if isinstance(request.get('data'), dict) else []
+    datas = [ request.get('data') ] + [ i.get('data') for i in request.get('items', []) ]
+    return [ e for d in datas for e in (d or {}).values() if isinstance(e, dict) ]
+
+def unpack_buffers(request, buffers):
+    # inverse of pack_buffers, in place
+    for entry in data_entries(request):
+        if 'buffer' in entry:
+            entry['data'] = buffers[entry.pop('buffer')]
+    return request
+
+def buffer_digest(value):
+    # buffers are keyed on their content, for json.dumps
+    if isinstance(value, (bytes, bytearray, memoryview)) or hasattr(value, 'dtype'):
+        return hashlib.blake2b(memoryview(value).cast('B'), digest_size=16).hexdigest()
+    raise TypeError(f'cannot serialize {type(value).__name__}')
+
+def write_request(fid, request):
+    # returns seconds spent producing code chunks and bytes written
+    request, buffers = pack_buffers(request)
+    code = request.get('code')
+    spent = 0.0
+
+    # plain request, json output is ascii
+    if code is None or isinstance(code, str):
+        line = (json.dumps(request) + '\n').encode()
+        fid.write(line)
+        nbytes = len(line)
+
+    # stream code chunks into the json string
+    else:
+        rest = { k: v for k, v in request.items() if k != 'code' }
+        head = f'{json.dumps(rest)[:-1]}{", " if len(rest) > 0 else ""}"code": "'.encode()
+        fid.write(head)
+        nbytes = len(head) + 3
+        chunks = iter(code)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                chunk = next(chunks, None)
+                spent += time.perf_counter() - t0
+                if chunk is None:
+                    break
+                text = json.dumps(chunk)[1:-1].encode()
+                fid.write(text)
+                nbytes += len(text)
+        except:
+            # close the line as a no-op with empty buffers so the stream stays in sync
+            fid.write(b'", "cmd": "ping"}\n')
+            for _ in buffers:
+                fid.write(BUFFER_PREFIX.pack(0))
+            raise
+        fid.write(b'"}\n')
+
+    # raw buffers go straight from the arrays
+    for view in buffers:
+        fid.write(BUFFER_PREFIX.pack(view.nbytes))
+        fid.write(view)
+        nbytes += BUFFER_PREFIX.size + view.nbytes
+    return spent, nbytes
+
+def read_request(stream):
+    # a request line and its buffers, None at the end of the stream
+    line = stream.readline()
+    if not line:
+        return None
+    request = json.loads(line)
+    buffers = []
+    for _ in range(request.pop('buffers', 0)):
+        prefix = bytearray(BUFFER_PREFIX.size)
+        if not read_exact(stream, memoryview(prefix)):
+            return None
+        buffer = bytearray(BUFFER_PREFIX.unpack(prefix)[0])
+        if not read_exact(stream, memoryview(buffer)):
+            return None
+        buffers.append(buffer)
+    return unpack_buffers(request, buffers)
+
+def kept_chunks(chunks, sent):
+    # pass chunks through, keeping them to resend as is
+    for chunk in chunks:
+        sent.append(chunk)
+        yield chunk
+
+# reply frames are two lengths, a json header, then raw utf-8 results
+FRAME_PREFIX = struct.Struct('<II')
+
+def read_exact(stream, view):
+    # fill the view, returning False on a short read
+    while len(view) > 0:
+        count = stream.readinto(view)
+        if not count:
+            return False
+        view = view[count:]
+    return True
+
+def read_frame(stream):
+    # one allocation and read for the whole frame
+    prefix = bytearray(FRAME_PREFIX.size)
+    if not read_exact(stream, memoryview(prefix)):
+        return None
+    hlen, blen = FRAME_PREFIX.unpack(prefix)
+    view = memoryview(bytearray(hlen + blen))
+    if not read_exact(stream, view):
+        return None
+    return view, hlen
+
+def decode_frame(view, hlen):
+    # string results become views into the body
+    response = json.loads(view[:hlen].tobytes())
+    body = view[hlen:]
+    if 'body' in response:
+        response['result'] = body[:response.pop('body')]
+    elif response['ok'] and isinstance(response.get('result'), list):
+        offset = 0
+        for item in response['result']:
+            if isinstance(item, dict) and 'size' in item:
+                size = item.pop('size')
+                item['result'] = body[offset:offset+size]
+                offset += size
+    return response
+
+def write_frame(fid, response):
+    # inverse of decode_frame, string results go in the body
+    header, bodies = dict(response), []
+    result = header.get('result')
+    if header['ok'] and isinstance(result, (bytes, bytearray, memoryview)):
+        header['body'] = len(result)
+        del header['result']
+        bodies.append(result)
+    elif header['ok'] and isinstance(result, list):
+        items = []
+        for item in result:
+            body = item.get('result')
+            if item['ok'] and isinstance(body, (bytes, bytearray, memoryview)):
+                items.append({ 'ok': True, 'size': len(body) })
+                bodies.append(body)
+            else:
+                items.append(item)
+        header['result'] = items
+    head = json.dumps(header).encode()
+    fid.write(FRAME_PREFIX.pack(len(head), sum(len(b) for b in bodies)))
+    fid.write(head)
+    for body in bodies:
+        fid.write(body)
+
+def as_text(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return str(value, 'utf-8')
+    return value
+
+def decoded(result, raw=False):
+    # svgs stay as bytes-like views when asked for raw output
+    if isinstance(result, tuple):
+        return decoded(result[0], raw), result[1]
+    return result if raw else as_text(result)
+
+def batch_item(item):
+    if isinstance(item, str):
+        return { 'code': item }
+    code, data = item
+    return { 'code': code } if data is None else { 'code': code, 'data': data }
+
+def data_refs(request):
+    # registry datasets a request refers to, batch items included
+    for entry in data_entries(request):
+        if 'ref' in entry:
+            yield entry['ref'], entry['digest']
+
+def put_request(name):
+    var = data_registry.get(name)
+    if var is None:
+        return None
+    return { 'cmd': 'put', 'name': name, 'digest': var.digest().hex(), **var.upload() }
+
+def no_data(response):
+    # a dataset was missing, for the request or any batch item
+    result = response['result']
+    if not response['ok']:
+        return result.get('error') == GumErrorType.NODATA
+    return isinstance(result, list) and any(
+        isinstance(r, dict) and not r['ok'] and r['result'].get('error') == GumErrorType.NODATA
+        for r in result
+    )
+
+def resolve(future, response):
+    from concurrent.futures import InvalidStateError
+    result = unpack(response)
+    try:
+        if isinstance(result, GumError):
+            future.set_exception(result)
+        elif 'profile' in response:
+            future.set_result((result, response['profile']))
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass # a timeout cancelled it meanwhile
+
+def fail(future, error):
+    from concurrent.futures import InvalidStateError
+    try:
+        future.set_exception(error)
+    except InvalidStateError:
+        pass # a timeout cancelled it meanwhile
+
 LIB_PATH = os.path.dirname(__file__)
 GUM_PATH = os.path.join(LIB_PATH, 'gum-jsx/gum.js')
 
+# compiled gum.js is cached here across runs, on node 22.1 and later
+COMPILE_CACHE = os.environ.get('GUM_COMPILE_CACHE', os.path.expanduser('~/.cache/gum/node'))
+
+def node_env():
+    # point node at the compile cache unless the caller already has
+    env = dict(os.environ)
+    if 'NODE_COMPILE_CACHE' not in env and COMPILE_CACHE:
+        try:
+            os.makedirs(COMPILE_CACHE, exist_ok=True)
+            env['NODE_COMPILE_CACHE'] = COMPILE_CACHE
+        except OSError:
+            pass
+    return env
+
 class GumUnixPipe:
     def __init__(self):
         self.proc = None
         self.debug = False
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.datasets = {}
+        self._ids = itertools.count()
+        self._killed = None
         self._pump_thread = None
-        self.init()
+        self._read_thread = None
+        self.spawned = None
+        self.startup = None
 
     def __del__(self):
         self.close()
 
-    def init(self):
-        self.proc = subprocess.Popen(
+    # requests run one at a time in the order sent
+    in_order = True
+
+    def spawn(self):
+        return subprocess.Popen(
             [ 'node', GUM_PATH ],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
+            env=node_env(),
         )
 
+    def init(self):
+        self.spawned = time.perf_counter()
+        self.proc = self.spawn()
+
+        # replies are matched to requests by id
+        self.pending = {}
+
+        # registry datasets this process holds, by digest
+        self.datasets = {}
+
         # pump stderr to stdout
         self._start_pump_loop()
 
+        # dispatch replies to futures
+        self._start_read_loop()
+
     def _start_pump_loop(self):
         def pump_loop():
             for line in self.proc.stderr:
                 if self.debug:
-                    print(f'[gum server] {line}')
+                    print(f'[gum server] {line.decode()}')
         self._pump_thread = threading.Thread(target=pump_loop, daemon=True)
         self._pump_thread.start()
 
-    def post(self, **request):
+    def _start_read_loop(self):
+        proc, pending = self.proc, self.pending
+        def read_loop():
+            # whatever happens here, the process is recovered after
+            try:
+                while (frame := read_frame(proc.stdout)) is not None:
+                    t0 = time.perf_counter()
+                    response = decode_frame(*frame)
+                    read = time.perf_counter() - t0
+                    if response.get('ready'):
+                        self.startup = finish_startup(self.spawned, response)
+                        continue
+                    if no_data(response):
+                        self.datasets.clear()
+                    entry = pending.pop(response.get('id'), None)
+                    if entry is None or entry[0].done():
+                        continue
+                    future, request, timing, retry = entry
+                    if retry and no_data(response):
+                        # evicted under us, so upload again off this thread
+                        threading.Thread(target=self._resend, args=(request, future, timing), daemon=True).start()
+                        continue
+                    if timing is not None:
+                        finish_timing(timing, response, len(frame[0]), read)
+                    resolve(future, response)
+            except OSError:
+                pass # socket reset under us, same as a closed pipe
+            finally:
+                self._recover(proc, pending)
+        self._read_thread = threading.Thread(target=read_loop, daemon=True)
+        self._read_thread.start()
+
+    def _recover(self, proc, pending):
+        with self.lock:
+            # respawn if the process died rather than by close
+            crashed = self.proc is proc
+            if crashed:
+                self._reap()
+
+            # requests run in order, so unless we killed it the oldest
+            # one took the process down and the rest never ran
+            culprit = crashed and self.in_order and proc is not self._killed
+            for ident in list(pending):
+                future, request, timing, retry = pending.pop(ident, (None, None, None, None))
+                if future is None or future.done():
+                    continue
+                if culprit:
+                    fail(future, ValueError('[gum server] worker crashed'))
+                    culprit = False
+                elif not crashed:
+                    fail(future, ValueError('[gum server] connection closed'))
+                else:
+                    try:
+                        self._submit(request, future=future, timing=timing, retry=retry)
+                    except Exception as e:
+                        fail(future, e)
+
+    def _resend(self, request, future, timing):
+        # one more try after the datasets were evicted
+        with self.lock:
+            if future.done():
+                return
+            try:
+                self._submit(request, future=future, timing=timing, retry=False)
+            except Exception as e:
+                fail(future, e)
+
+    def _send(self, request, future=None, timing=None, retry=True):
+        from concurrent.futures import Future
+        future = Future() if future is None else future
+
+        # renders are timed, other commands aren't
+        if timing is None and request.get('cmd', 'eval') in ('eval', 'batch'):
+            timing = new_timing()
+
+        # register before sending so the reply can't beat us, keeping
+        # requests around to resend if the process dies, with streamed
+        # code filled in as it goes out (we hold the lock till then)
+        ident = next(self._ids)
+        code, sent = request.get('code'), None
+        kept = dict(request)
+        if code is not None and not isinstance(code, str):
+            sent = kept['code'] = []
+            request = { **request, 'code': kept_chunks(code, sent) }
+        self.pending[ident] = (future, kept, timing, retry)
+
+        # send request
+        request1 = { k: v for k, v in request.items() if v is not None }
+        try:
+            t0 = time.perf_counter()
+            spent, nbytes = write_request(self.proc.stdin, { 'id': ident, **request1 })
+            self.proc.stdin.flush()
+            if timing is not None:
+                timing['serialize'] = timing.get('serialize', 0.0) + spent
+                timing['write'] = time.perf_counter() - t0 - spent
+                timing['bytes_out'] = nbytes
+        except OSError:
+            # the process died or was killed before the reader noticed,
+            # so leave the request for it to resend once it respawns
+            if sent is not None:
+                for _ in request['code']:
+                    pass
+        except:
+            self.pending.pop(ident, None)
+            raise
+
+        # return handle
+        return future
+
+    def _upload(self, name, digest=None):
+        # send a registry dataset unless this process already has it
+        request = put_request(name)
+        if request is None or self.datasets.get(name) == (digest or request['digest']):
+            return
+        self.datasets[name] = request['digest']
+        future = self._send(request)
+        def evicted(future):
+            if future.exception() is None:
+                for name1 in future.result():
+                    self.datasets.pop(name1, None)
+        future.add_done_callback(evicted)
+
+    def _submit(self, request, future=None, timing=None, retry=True):
         # ensure server
         if self.proc is None:
             self.init()
 
-        # send request
-        request1 = { k: v for k, v in request.items() if v is not None }
-        self.proc.stdin.write(json.dumps(request1) + '\n')
-        self.proc.stdin.flush()
+        # referenced datasets go first on the same pipe
+        for name, digest in data_refs(request):
+            self._upload(name, digest)
 
-        # get reply
-        reply = self.proc.stdout.readline()
-        if reply == '':
-            raise ValueError('[gum server] connection closed')
+        return self._send(request, future=future, timing=timing, retry=retry)
 
-        # read response
-        response = json.loads(reply)
-        ok, result = response['ok'], response['result']
+    def submit(self, timing=None, **request):
+        with self.lock:
+            return self._submit(request, timing=timing)
 
-        # check for errors
-        if not ok:
-            etype = result['error']
-            emsg = result['message']
-            raise GumError(etype, emsg)
+    def wait(self, future, timeout=None):
+        from concurrent.futures import TimeoutError
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            self.abort(future)
+            raise GumError(GumErrorType.TIMEOUT, f'render timed out after {timeout}s')
 
-        # return response
-        return result
+    def _forget(self, future):
+        # drop the request so a late reply is ignored
+        for ident, (future1, *_) in list(self.pending.items()):
+            if future1 is future:
+                self.pending.pop(ident, None)
+        future.cancel()
+
+    def abort(self, future):
+        # forget the request and kill the process, the reader respawns it
+        self._forget(future)
+        proc = self._killed = self.proc
+        if proc is not None:
+            proc.kill()
+
+    def upload(self, name):
+        with self.lock:
+            if self.proc is not None:
+                self._upload(name)
+
+    def drop(self, name):
+        with self.lock:
+            if self.proc is not None and self.datasets.pop(name, None) is not None:
+                self._send({ 'cmd': 'drop', 'name': name })
+
+    def post(self, timeout=None, timing=None, **request):
+        return self.wait(self.submit(timing=timing, **request), timeout)
+
+    def _reap(self):
+        # detach first so the reader knows this was on purpose
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
 
     def close(self):
         if self.proc is not None:
-            self.proc.stdin.close()
-            self.proc.wait(timeout=1)
-            self.proc = None
+            self._reap()
         self._pump_thread = None
+        self._read_thread = None
 
     def restart(self):
-        self.close()
-        self.init()
+        with self.lock:
+            self.close()
+            self.init()
+
+    def ping(self):
+        return as_text(self.post(cmd='ping'))
+
+    def evaluate(self, code, pixels=None, timeout=None, raw=False, **kwargs):
+        result = self.post(code=code, size=pixels, timeout=timeout, **kwargs)
+        return decoded(result, raw)
+
+    def evaluate_many(self, items, pixels=None, timeout=None, raw=False, **kwargs):
+        items = [ batch_item(i) for i in items ]
+        results = self.post(cmd='batch', items=items, size=pixels, timeout=timeout, **kwargs)
+        return [ decoded(unpack(r), raw) for r in results ]
+
+class GumPool:
+    def __init__(self, size=None):
+        self.size = size if size is not None else (os.cpu_count() or 1)
+        self.debug = False
+        self.workers = []
+        self.load = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.workers)
+
+    def _spawn(self):
+        worker = GumUnixPipe()
+        worker.debug = self.debug
+        self.workers.append(worker)
+        self.load.append(0)
+        return len(self.workers) - 1
+
+    def _acquire(self):
+        with self._lock:
+            # find least busy worker
+            index = min(range(len(self.workers)), key=lambda i: self.load[i], default=None)
+
+            # grow the pool if everyone is busy
+            if index is None or (self.load[index] > 0 and len(self.workers) < self.size):
+                index = self._spawn()
+
+            # mark as busy
+            self.load[index] += 1
+            return index
+
+    def _release(self, index):
+        with self._lock:
+            self.load[index] -= 1
+
+    def _submit(self, request, timing=None):
+        index = self._acquire()
+        worker = self.workers[index]
+        try:
+            future = worker.submit(timing=timing, **request)
+        except:
+            self._release(index)
+            raise
+        future.add_done_callback(lambda _: self._release(index))
+        return worker, future
+
+    def submit(self, timing=None, **request):
+        _, future = self._submit(request, timing=timing)
+        return future
+
+    def post(self, timeout=None, timing=None, **request):
+        worker, future = self._submit(request, timing=timing)
+        return worker.wait(future, timeout)
+
+    def abort(self, future):
+        # kill whichever worker holds the request
+        with self._lock:
+            workers = list(self.workers)
+        for worker in workers:
+            if any(future1 is future for future1, *_ in list(worker.pending.values())):
+                return worker.abort(future)
+        future.cancel()
+
+    def prewarm(self, count=None):
+        count = self.size if count is None else min(count, self.size)
+        with self._lock:
+            while len(self.workers) < count:
+                self._spawn()
+            workers = list(self.workers)
+        for worker in workers:
+            worker.ping()
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            while len(self.workers) > max(size, 1) and self.load[-1] == 0:
+                self.workers.pop().close()
+                self.load.pop()
 
-    def evaluate(self, code, pixels=None, **kwargs):
-        return self.post(code=code, size=pixels, **kwargs)
+    def upload(self, name):
+        with self._lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.upload(name)
+
+    def drop(self, name):
+        with self._lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.drop(name)
+
+    def set_debug(self, debug=True):
+        with self._lock:
+            self.debug = debug
+            for worker in self.workers:
+                worker.debug = debug
+
+    def close(self):
+        with self._lock:
+            for worker in self.workers:
+                with worker.lock:
+                    worker.close()
+
+    def restart(self):
+        with self._lock:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.restart()
+
+    def evaluate(self, code, pixels=None, timeout=None, raw=False, **kwargs):
+        result = self.post(code=code, size=pixels, timeout=timeout, **kwargs)
+        return decoded(result, raw)
+
+    def batch(self, items, timeout=None, **request):
+        # one contiguous chunk per worker, raw replies back in order
+        nchunks = max(1, min(self.size, len(items)))
+        bounds = [ len(items) * i // nchunks for i in range(nchunks + 1) ]
+        handles = [
+            self._submit({ 'cmd': 'batch', 'items': items[lo:hi], **request })
+            for lo, hi in zip(bounds[:-1], bounds[1:])
+        ]
+        return [ r for w, f in handles for r in w.wait(f, timeout) ]
+
+    def evaluate_many(self, items, pixels=None, timeout=None, raw=False, **kwargs):
+        items = [ batch_item(i) for i in items ]
+        results = self.batch(items, timeout=timeout, size=pixels, **kwargs)
+        return [ decoded(unpack(r), raw) for r in results ]
+
+async def read_frame_async(reader):
+    import asyncio
+    try:
+        prefix = await reader.readexactly(FRAME_PREFIX.size)
+        hlen, blen = FRAME_PREFIX.unpack(prefix)
+        data = await reader.readexactly(hlen + blen)
+    except asyncio.IncompleteReadError:
+        return None
+    return memoryview(data), hlen
+
+class AsyncGumPipe:
+    def __init__(self):
+        self.proc = None
+        self.debug = False
+        self.pending = {}
+        self.datasets = {}
+        self._ids = itertools.count()
+        self._killed = None
+        self._init_lock = None
+        self._tasks = []
+        self._resends = set()
+        self.spawned = None
+        self.startup = None
+
+    async def init(self):
+        import asyncio
+        self.spawned = time.perf_counter()
+        self.proc = await asyncio.create_subprocess_exec(
+            'node', GUM_PATH,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=node_env(),
+        )
+
+        # replies are matched to requests by id
+        self.pending = {}
+
+        # registry datasets this process holds, by digest
+        self.datasets = {}
+
+        # pump stderr and dispatch replies
+        self._tasks = [
+            asyncio.ensure_future(self._pump_loop(self.proc)),
+            asyncio.ensure_future(self._read_loop(self.proc, self.pending)),
+        ]
+
+    async def ensure(self):
+        import asyncio
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.proc is None:
+                await self.init()
+
+    async def _pump_loop(self, proc):
+        async for line in proc.stderr:
+            if self.debug:
+                print(f'[gum server] {line.decode()}')
+
+    async def _read_loop(self, proc, pending):
+        while (frame := await read_frame_async(proc.stdout)) is not None:
+            t0 = time.perf_counter()
+            response = decode_frame(*frame)
+            read = time.perf_counter() - t0
+            if response.get('ready'):
+                self.startup = finish_startup(self.spawned, response)
+                continue
+            if no_data(response):
+                self.datasets.clear()
+            entry = pending.pop(response.get('id'), None)
+            if entry is None or entry[0].done():
+                continue
+            future, request, timing, retry = entry
+            if retry and no_data(response):
+                # evicted under us, so upload again without blocking reads
+                self._resend(request, future, timing)
+                continue
+            if timing is not None:
+                finish_timing(timing, response, len(frame[0]), read)
+            resolve(future, response)
+        await self._recover(proc, pending)
+
+    async def _recover(self, proc, pending):
+        # respawn if the process died rather than by close
+        crashed = self.proc is proc
+        if crashed:
+            self.proc = None
+            await proc.wait()
+
+        # requests run in order, so unless we killed it the oldest
+        # one took the process down and the rest never ran
+        culprit = crashed and proc is not self._killed
+        entries = list(pending.values())
+        pending.clear()
+        for future, request, timing, retry in entries:
+            if future.done():
+                continue
+            if culprit:
+                future.set_exception(ValueError('[gum server] worker crashed'))
+                culprit = False
+            elif not crashed:
+                future.set_exception(ValueError('[gum server] connection closed'))
+            else:
+                try:
+                    await self._submit(request, future=future, timing=timing, retry=retry)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _resend(self, request, future, timing):
+        # one more try after the datasets were evicted
+        import asyncio
+        async def resend():
+            if future.done():
+                return
+            try:
+                await self._submit(request, future=future, timing=timing, retry=False)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+        task = asyncio.ensure_future(resend())
+        self._resends.add(task)
+        task.add_done_callback(self._resends.discard)
+
+    async def _submit(self, request, future=None, timing=None, retry=True):
+        await self.ensure()
+
+        # referenced datasets go first on the same pipe
+        for name, digest in data_refs(request):
+            upload = put_request(name)
+            if upload is not None and self.datasets.get(name) != digest:
+                self.datasets[name] = upload['digest']
+                await self._send(upload)
+
+        return await self._send(request, future=future, timing=timing, retry=retry)
+
+    async def submit(self, timing=None, **request):
+        return await self._submit(request, timing=timing)
+
+    async def _send(self, request, future=None, timing=None, retry=True):
+        import asyncio
+
+        # renders are timed, other commands aren't
+        if timing is None and request.get('cmd', 'eval') in ('eval', 'batch'):
+            timing = new_timing()
+
+        # register before sending so the reply can't beat us, keeping
+        # requests around to resend if the process dies
+        ident = next(self._ids)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+        self.pending[ident] = (future, request, timing, retry)
+
+        # send request
+        request1 = { k: v for k, v in request.items() if v is not None }
+        try:
+            t0 = time.perf_counter()
+            _, nbytes = write_request(self.proc.stdin, { 'id': ident, **request1 })
+            await self.proc.stdin.drain()
+            if timing is not None:
+                timing['write'] = time.perf_counter() - t0
+                timing['bytes_out'] = nbytes
+        except (BrokenPipeError, ConnectionResetError):
+            self.pending.pop(ident, None)
+            raise ValueError('[gum server] connection closed')
+
+        # return handle
+        return ident, future
+
+    def _forget(self, future):
+        # a resent request has a new id, so match on the future
+        idents = [ i for i, (future1, *_) in self.pending.items() if future1 is future ]
+        for ident in idents:
+            self.pending.pop(ident, None)
+        return len(idents) > 0
+
+    def abort(self, future):
+        # forget the request and kill the process, the reader respawns it
+        self._forget(future)
+        if self.proc is not None:
+            self._killed = self.proc
+            self.proc.kill()
+
+    async def post(self, timeout=None, timing=None, **request):
+        import asyncio
+        ident, future = await self.submit(timing=timing, **request)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.abort(future)
+            raise GumError(GumErrorType.TIMEOUT, f'render timed out after {timeout}s')
+        except asyncio.CancelledError:
+            # a cancelled render may be hung, so free the worker like a timeout
+            if self._forget(future):
+                self.abort(future)
+            raise
+        finally:
+            # on cancel or timeout the late reply is dropped
+            self._forget(future)
+
+    async def close(self):
+        import asyncio
+        if self.proc is not None:
+            # detach first so the reader knows this was on purpose
+            proc, self.proc = self.proc, None
+            proc.stdin.close()
+            try:
+                await asyncio.wait_for(proc.wait(), 1)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+        # the reader may not get to fail these
+        for future, *_ in self.pending.values():
+            if not future.done():
+                future.set_exception(ValueError('[gum server] connection closed'))
+        self.pending.clear()
+
+    async def restart(self):
+        await self.close()
+        await self.init()
+
+    async def evaluate(self, code, pixels=None, timeout=None, raw=False, **kwargs):
+        result = await self.post(code=code, size=pixels, timeout=timeout, **kwargs)
+        return decoded(result, raw)
+
+##
+## render cache
+##
+
+# hash of the bundled gum.js, computed once
+_gum_version = None
+
+def gum_version():
+    global _gum_version
+    if _gum_version is None:
+        try:
+            _gum_version = hashlib.sha256(readbin(GUM_PATH)).hexdigest()[:16]
+        except OSError:
+            _gum_version = 'unknown'
+    return _gum_version
+
+class RenderCache:
+    def __init__(self, size=256, path=None, max_bytes=256*1024**2):
+        self.size = size
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+
+        # tally existing disk entries
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self.disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def key(self, code, **kwargs):
+        payload = json.dumps({ 'version': gum_version(), 'code': code, **kwargs }, sort_keys=True, default=buffer_digest)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.path, f'{key}.svg')
+
+    def _disk_entries(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.svg'):
+                stat = entry.stat()
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def _remember(self, key, svg):
+        self.memory[key] = svg
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            # memory tier
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+            # disk tier
+            if self.path is not None:
+                path = self._disk_path(key)
+                try:
+                    svg = readbin(path)
+                    os.utime(path) # mark as recently used
+                except OSError:
+                    pass
+                else:
+                    self._remember(key, svg)
+                    self.hits += 1
+                    return svg
+
+            # not found
+            self.misses += 1
+            return None
+
+    def put(self, key, svg):
+        # entries are kept as utf-8 bytes
+        svg = svg.encode() if isinstance(svg, str) else bytes(svg)
+        with self.lock:
+            self._remember(key, svg)
+            if self.path is not None:
+                self._store(key, svg)
+
+    def _store(self, key, svg):
+        # write atomically so readers never see partial files
+        path = self._disk_path(key)
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as fid:
+            fid.write(svg)
+        os.replace(temp, path)
+        self.disk_bytes += len(svg)
+
+        # evict least recently used files
+        if self.disk_bytes > self.max_bytes:
+            entries = sorted(self._disk_entries(), key=lambda e: e[1])
+            self.disk_bytes = sum(size for _, _, size in entries)
+            for epath, _, esize in entries:
+                if self.disk_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(epath)
+                    self.disk_bytes -= esize
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.path is not None:
+                for epath, _, _ in list(self._disk_entries()):
+                    os.remove(epath)
+                self.disk_bytes = 0
+
+    def info(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.memory),
+                'disk_bytes': self.disk_bytes,
+            }
 
 ##
 ## server instance
 ##
 
-# singleton server instance
-server = GumUnixPipe()
+# datasets kept in the render servers, by name
+data_registry = {}
+
+def default_server(path=None):
+    # a shared socket server if given, otherwise local workers
+    if path is None:
+        return GumPool()
+    from .srv import GumSocketClient
+    return GumSocketClient(path)
+
+# singleton server instance, workers are spawned on first use
+server = default_server(os.environ.get('GUM_SOCKET'))
+
+def connect(path=None):
+    # render through a shared server, or local workers if no path
+    global server
+    server.close()
+    server = default_server(path)
+
+def prewarm(workers=None):
+    server.prewarm(workers)
 
 def restart():
     server.restart()
 
 def set_debug(debug=True):
-    server.debug = debug
+    server.set_debug(debug)
+    for async_server in async_servers.values():
+        async_server.debug = debug
+
+def set_workers(size=None):
+    server.resize(size if size is not None else (os.cpu_count() or 1))
+
+# default render deadline in seconds, None waits forever
+default_timeout = None
+
+def set_timeout(seconds=None):
+    global default_timeout
+    default_timeout = seconds
+
+def get_timeout(timeout):
+    return timeout if timeout is not None else default_timeout
+
+def put_data(name, value):
+    from .utl import DataVar
+    from .gen import GumData
+
+    # frames become one dataset per column, no frame without pandas loaded
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(value, pd.DataFrame):
+        index = put_data(f'{name}_index', value.index)
+        data = [ put_data(f'{name}_{i}', value[col]) for i, col in enumerate(value) ]
+        return GumData(data, index=index)
+
+    # arrays are held as is, series and indexes without copying
+    if hasattr(value, 'to_numpy'):
+        value = value.to_numpy(copy=False)
+
+    # store and send to running workers, others get it on first use
+    var = DataVar(name, value)
+    data_registry[name] = var
+    server.upload(name)
+    return var
+
+def drop_data(name):
+    if data_registry.pop(name, None) is not None:
+        server.drop(name)
+
+# optional render cache
+render_cache = None
+
+def set_cache(enable=True, size=256, path=None, max_bytes=256*1024**2):
+    global render_cache
+    render_cache = RenderCache(size=size, path=path, max_bytes=max_bytes) if enable else None
+
+def cache_info():
+    return render_cache.info() if render_cache is not None else None
+
+def cache_key(code, **kwargs):
+    # structural hash avoids serializing elements on a hit
+    if hasattr(code, 'digest'):
+        return render_cache.key(None, digest=code.digest(), **kwargs), None
+
+    # otherwise key on the payload
+    payload = serialize(code)
+    code1, data = payload
+    return render_cache.key(code1, data=data, **kwargs), payload
+
+def timed(timing, func, *args, **kwargs):
+    # python side serialization time
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    timing['serialize'] = timing.get('serialize', 0.0) + time.perf_counter() - t0
+    return result
+
+def profiled(result, profile):
+    # write the cpu profile out or hand it back
+    svg, prof = result
+    if profile is True:
+        return svg, prof
+    with open(os.path.expanduser(profile), 'w') as fid:
+        json.dump(prof, fid)
+    return svg, None
+
+def outputs(svg, record=None, prof=None, timing=False, profile=False):
+    # svg plus whichever extras were asked for
+    extra = []
+    if timing:
+        extra.append(record)
+    if profile is True:
+        extra.append(prof)
+    return (svg, *extra) if len(extra) > 0 else svg
+
+def evaluate(code, pixels=500, timeout=None, timing=False, profile=False, raw=False, **kwargs):
+    timeout = get_timeout(timeout)
+    record = new_timing()
+
+    # profiled renders skip the cache
+    if profile:
+        code, data = timed(record, serialize, code, stream=True)
+        result = server.evaluate(code, pixels=pixels, timeout=timeout, timing=record, data=data, profile=True, raw=raw, **kwargs)
+        svg, prof = profiled(result, profile)
+        return outputs(svg, record, prof, timing=timing, profile=profile)
+
+    # stream straight into the pipe
+    if render_cache is None:
+        code, data = timed(record, serialize, code, stream=True)
+        svg = server.evaluate(code, pixels=pixels, timeout=timeout, timing=record, data=data, raw=raw, **kwargs)
+        return outputs(svg, record, timing=timing)
+
+    # check cache first
+    key, payload = timed(record, cache_key, code, size=pixels, **kwargs)
+    svg = render_cache.get(key)
+    if svg is None:
+        code, data = payload if payload is not None else timed(record, serialize, code)
+        svg = server.evaluate(code, pixels=pixels, timeout=timeout, timing=record, data=data, raw=True, **kwargs)
+        render_cache.put(key, svg)
+    else:
+        record['cached'] = True
+        record['total'] = time.perf_counter() - record.pop('start')
+    return outputs(decoded(svg, raw), record, timing=timing)
+
+def evaluate_many(codes, pixels=500, timeout=None, raw=False, **kwargs):
+    timeout = get_timeout(timeout)
+
+    # bypass cache
+    if render_cache is None:
+        items = [ serialize(c) for c in codes ]
+        return server.evaluate_many(items, pixels=pixels, timeout=timeout, raw=raw, **kwargs)
+
+    # only send cache misses
+    entries = [ cache_key(c, size=pixels, **kwargs) for c in codes ]
+    keys = [ k for k, _ in entries ]
+    results = [ render_cache.get(k) for k in keys ]
+    missing = [ i for i, r in enumerate(results) if r is None ]
+    if len(missing) > 0:
+        items = [ entries[i][1] or serialize(codes[i]) for i in missing ]
+        fresh = server.evaluate_many(items, pixels=pixels, timeout=timeout, raw=True, **kwargs)
+        for i, svg in zip(missing, fresh):
+            if not isinstance(svg, GumError):
+                render_cache.put(keys[i], svg)
+            results[i] = svg
+    return [ decoded(r, raw) for r in results ]
+
+# one async server per event loop
+async_servers = weakref.WeakKeyDictionary()
+
+def get_async_server():
+    import asyncio
+    from .srv import GumSocketClient, AsyncSocketClient
+    # a shared server already renders concurrently
+    if isinstance(server, GumSocketClient):
+        return AsyncSocketClient(server)
+    loop = asyncio.get_running_loop()
+    if loop not in async_servers:
+        async_server = AsyncGumPipe()
+        async_server.debug = server.debug
+        async_servers[loop] = async_server
+    return async_servers[loop]
+
+async def evaluate_async(code, pixels=500, timeout=None, timing=False, profile=False, raw=False, **kwargs):
+    async_server = get_async_server()
+    timeout = get_timeout(timeout)
+    record = new_timing()
+
+    # profiled renders skip the cache
+    if profile:
+        code, data = timed(record, serialize, code)
+        result = await async_server.evaluate(code, pixels=pixels, timeout=timeout, timing=record, data=data, profile=True, raw=raw, **kwargs)
+        svg, prof = profiled(result, profile)
+        return outputs(svg, record, prof, timing=timing, profile=profile)
+
+    # bypass cache
+    if render_cache is None:
+        code, data = timed(record, serialize, code)
+        svg = await async_server.evaluate(code, pixels=pixels, timeout=timeout, timing=record, data=data, raw=raw, **kwargs)
+        return outputs(svg, record, timing=timing)
 
-def evaluate(code, pixels=500, **kwargs):
-    return server.evaluate(str(code), pixels=pixels, **kwargs)
+    # check cache first
+    key, payload = timed(record, cache_key, code, size=pixels, **kwargs)
+    svg = render_cache.get(key)
+    if svg is None:
+        code, data = payload if payload is not None else timed(record, serialize, code)
+        svg = await async_server.evaluate(code, pixels=pixels, timeout=timeout, timing=record, data=data, raw=True, **kwargs)
+        render_cache.put(key, svg)
+    else:
+        record['cached'] = True
+        record['total'] = time.perf_counter() - record.pop('start')
+    return outputs(decoded(svg, raw), record, timing=timing)
 
 def display(code, size='80x25', theme='dark', format=None, **kwargs):
-    data = evaluate(str(code), theme=theme, **kwargs).encode()
+    data = evaluate(code, theme=theme, raw=True, **kwargs)
     chafa(data, size=size, format=format)
 
 def display_file(path, **kwargs):
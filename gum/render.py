@@ -0,0 +1,170 @@
+# batch rendering of jsx files
+
+import os
+import json
+import glob
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .gum import GumPool, GumError, gum_version, readbin, new_timing, percentile
+
+# render hashes by output path, kept next to the outputs
+MANIFEST = '.gum-manifest.json'
+
+##
+## inputs and outputs
+##
+
+def expand(patterns):
+    # the shell expands most globs, quoted ones and directories are ours
+    paths = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        elif os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '**', '*.jsx'), recursive=True))
+        else:
+            matches = [ pattern ]
+        paths.extend(m for m in matches if not os.path.isdir(m))
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+def output_paths(inputs, output=None):
+    # mirror the tree below the common input directory
+    if len(inputs) == 0:
+        return os.getcwd(), {}
+    base = os.path.commonpath([ os.path.dirname(p) for p in inputs ])
+    root = os.path.abspath(output) if output is not None else base
+    outputs = {
+        p: os.path.join(root, os.path.splitext(os.path.relpath(p, base))[0] + '.svg')
+        for p in inputs
+    }
+    return root, outputs
+
+def content_key(source, pixels, theme):
+    payload = json.dumps({ 'version': gum_version(), 'size': pixels, 'theme': theme }).encode()
+    return hashlib.sha256(payload + source).hexdigest()
+
+def load_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST)) as fid:
+            return json.load(fid)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'w') as fid:
+        json.dump(manifest, fid, indent=1, sort_keys=True)
+    os.replace(temp, path)
+
+def write_output(path, svg):
+    # write atomically so a failed run never leaves partial files
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as fid:
+        fid.write(svg)
+    os.replace(temp, path)
+
+##
+## rendering
+##
+
+def render_files(patterns, output=None, jobs=None, pixels=500, theme=None, timeout=None, force=False, log=None):
+    t_start = time.perf_counter()
+    inputs = expand(patterns)
+    root, outputs = output_paths(inputs, output)
+    manifest = {} if force else load_manifest(root)
+
+    # skip inputs whose hash matches what produced the existing output
+    todo = []
+    skipped = 0
+    for src in inputs:
+        dst = outputs[src]
+        rel = os.path.relpath(dst, root)
+        try:
+            source = readbin(src)
+        except OSError as e:
+            todo.append((src, dst, rel, None, e))
+            continue
+        key = content_key(source, pixels, theme)
+        if manifest.get(rel) == key and os.path.exists(dst):
+            skipped += 1
+        else:
+            todo.append((src, dst, rel, key, source))
+
+    # one node worker per job, files rendered as workers free up
+    pool = GumPool(jobs)
+    def render(entry):
+        src, dst, rel, key, source = entry
+        if key is None:
+            return entry, None, source
+        timing = new_timing()
+        try:
+            svg = pool.post(timeout=timeout, timing=timing, code=source.decode('utf-8'), size=pixels, theme=theme)
+            write_output(dst, svg)
+        except (GumError, ValueError, OSError) as e:
+            return entry, None, e
+        return entry, timing['total'], None
+
+    times, failures = {}, {}
+    try:
+        with ThreadPoolExecutor(pool.size) as executor:
+            for (src, dst, rel, key, _), seconds, error in executor.map(render, todo):
+                if error is None:
+                    manifest[rel] = key
+                    times[src] = seconds
+                else:
+                    manifest.pop(rel, None)
+                    failures[src] = error
+                if log is not None:
+                    log(src, dst, seconds, error)
+    finally:
+        pool.close()
+
+    if len(todo) > 0:
+        os.makedirs(root, exist_ok=True)
+        save_manifest(root, manifest)
+
+    return {
+        'rendered': len(times),
+        'skipped': skipped,
+        'failed': len(failures),
+        'elapsed': time.perf_counter() - t_start,
+        'times': times,
+        'failures': failures,
+    }
+
+##
+## reporting
+##
+
+def format_error(error):
+    if isinstance(error, GumError):
+        return f'{error.error_type}: {error.error_message}'
+    return str(error)
+
+def print_summary(summary, slowest=5):
+    rendered, skipped, failed = summary['rendered'], summary['skipped'], summary['failed']
+    elapsed = summary['elapsed']
+    rate = rendered / elapsed if elapsed > 0 else 0.0
+    print(f'rendered {rendered}, skipped {skipped}, failed {failed} in {elapsed:.2f}s ({rate:.1f} files/s)')
+
+    # latency spread and the worst offenders
+    times = summary['times']
+    if len(times) > 0:
+        values = sorted(times.values())
+        print(
+            f'render ms: p50 {1000 * percentile(values, 0.50):.1f} '
+            f'p95 {1000 * percentile(values, 0.95):.1f} max {1000 * values[-1]:.1f}'
+        )
+        print('slowest:')
+        for path, seconds in sorted(times.items(), key=lambda x: -x[1])[:slowest]:
+            print(f'  {1000 * seconds:>9.1f} ms  {os.path.relpath(path)}')
+
+    # everything that went wrong
+    if failed > 0:
+        print('failures:')
+        for path, error in summary['failures'].items():
+            print(f'  {os.path.relpath(path)}: {format_error(error)}')
@@ -0,0 +1,299 @@
+# socket server
+
+import os
+import sys
+import threading
+
+from .gum import GumUnixPipe, GumPool, GumError, GumErrorType, data_registry, data_entries, read_request, write_frame, new_timing, decoded
+
+##
+## clients
+##
+
+# where the shared server listens unless told otherwise
+GUM_SOCKET = os.environ.get('GUM_SOCKET', '/tmp/gum.sock')
+
+# extra seconds a client waits past its deadline before giving up on the server
+SOCKET_GRACE = 5
+
+# renders the server waits on at once
+SERVE_THREADS = 64
+
+class SocketConnection:
+    # a unix socket with the parts of a process the pipe uses
+    def __init__(self, path):
+        import socket
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+        except:
+            self.sock.close()
+            raise
+        self.stdin = self.sock.makefile('wb')
+        self.stdout = self.sock.makefile('rb')
+        self.stderr = ()
+
+    def kill(self):
+        import socket
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def wait(self, timeout=None):
+        self.kill()
+        self.sock.close()
+
+class GumSocketClient(GumUnixPipe):
+    # the server runs requests concurrently across its workers
+    in_order = False
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path if path is not None else GUM_SOCKET
+
+    def spawn(self):
+        # a server that went away fails renders rather than raising os errors
+        try:
+            return SocketConnection(self.path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise GumError(GumErrorType.SERVER, f'no server listening on {self.path}') from e
+
+    def post(self, timeout=None, timing=None, **request):
+        # the server enforces the deadline, we only give up if it goes quiet
+        future = self.submit(timing=timing, deadline=timeout, **request)
+        return self.wait(future, None if timeout is None else timeout + SOCKET_GRACE)
+
+    def prewarm(self, count=None):
+        self.ping()
+
+    def resize(self, size):
+        # the server owns its pool
+        pass
+
+    def set_debug(self, debug=True):
+        self.debug = debug
+
+class AsyncSocketClient:
+    # evaluate_async through a socket client, which never blocks on a render
+    def __init__(self, client):
+        self.client = client
+
+    async def evaluate(self, code, pixels=None, timeout=None, raw=False, timing=None, **kwargs):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        submit = lambda: self.client.submit(timing=timing, code=code, size=pixels, deadline=timeout, **kwargs)
+        future = await loop.run_in_executor(None, submit)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), None if timeout is None else timeout + SOCKET_GRACE)
+        except asyncio.TimeoutError:
+            self.client.abort(future)
+            raise GumError(GumErrorType.TIMEOUT, f'render timed out after {timeout}s')
+        except asyncio.CancelledError:
+            # the server holds the deadline, so only drop the reply
+            self.client._forget(future)
+            raise
+        return decoded(result, raw)
+
+##
+## daemon
+##
+
+class RelayedData:
+    # dataset a socket client uploaded, kept in its encoded form
+    def __init__(self, digest, payload):
+        self._digest = bytes.fromhex(digest)
+        self.payload = payload
+
+    def digest(self):
+        return self._digest
+
+    def upload(self):
+        return self.payload
+
+class GumSocketServer:
+    def __init__(self, path=None, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.path = path if path is not None else GUM_SOCKET
+        self.pool = GumPool(workers)
+        self.executor = ThreadPoolExecutor(SERVE_THREADS)
+        self.lock = threading.Lock()
+        self.refs = {}
+        self.sock = None
+
+        # open client connections, shut down on close
+        self.clients = set()
+
+    def listen(self):
+        import socket
+
+        # clear out a socket left by a dead server, but not a live one
+        if os.path.exists(self.path):
+            try:
+                SocketConnection(self.path).wait()
+            except OSError:
+                os.remove(self.path)
+            else:
+                raise OSError(f'[gum server] already serving on {self.path}')
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen()
+
+    def serve_forever(self):
+        if self.sock is None:
+            self.listen()
+        self.pool.prewarm()
+        while (sock := self.sock) is not None:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                if self.sock is None:
+                    break # closed under us
+                raise
+            with self.lock:
+                self.clients.add(conn)
+            thread = threading.Thread(target=self._serve_client, args=(conn,), daemon=True)
+            thread.start()
+
+    def close(self):
+        import socket
+        if self.sock is not None:
+            # shutdown wakes a thread blocked in accept
+            sock, self.sock = self.sock, None
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+        # hang up on clients so they see the server go rather than failed renders
+        with self.lock:
+            clients = list(self.clients)
+            self.clients.clear()
+        for conn in clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.executor.shutdown(wait=False)
+        self.pool.close()
+
+    def _serve_client(self, conn):
+        # datasets this client put, by name
+        names = {}
+
+        # replies finish out of order, one writer at a time
+        reader, writer = conn.makefile('rb'), conn.makefile('wb')
+        lock = threading.Lock()
+        def reply(response):
+            with lock:
+                try:
+                    write_frame(writer, response)
+                    writer.flush()
+                except OSError:
+                    pass # client went away
+
+        try:
+            while (request := read_request(reader)) is not None:
+                ident = request.pop('id', None)
+                try:
+                    self._dispatch(request, names, lambda r, i=ident: reply({ 'id': i, **r }))
+                except Exception as e:
+                    reply({ 'id': ident, **failure(e) })
+        except (OSError, ValueError):
+            pass # dropped or garbled connection
+        finally:
+            for digest in names.values():
+                self._release(digest)
+            with self.lock:
+                self.clients.discard(conn)
+            for fid in (reader, writer, conn):
+                try:
+                    fid.close()
+                except OSError:
+                    pass
+
+    def _dispatch(self, request, names, reply):
+        cmd = request.pop('cmd', 'eval')
+
+        # datasets are shared between clients by digest
+        if cmd == 'put':
+            name, digest = request.pop('name'), request.pop('digest')
+            self._retain(digest, request)
+            old = names.get(name)
+            names[name] = digest
+            if old is not None:
+                self._release(old)
+            return reply({ 'ok': True, 'result': [] })
+        if cmd == 'drop':
+            digest = names.pop(request['name'], None)
+            if digest is not None:
+                self._release(digest)
+            return reply({ 'ok': True, 'result': None })
+
+        # renders block on a worker, so wait for them off this thread
+        for entry in data_entries(request):
+            if 'ref' in entry:
+                entry['ref'] = entry['digest']
+        deadline = request.pop('deadline', None)
+        self.executor.submit(self._relay, cmd, request, deadline, reply)
+
+    def _relay(self, cmd, request, deadline, reply):
+        try:
+            if cmd == 'batch':
+                items = request.pop('items')
+                return reply({ 'ok': True, 'result': self.pool.batch(items, timeout=deadline, **request) })
+            timing = new_timing() if cmd == 'eval' else None
+            result = self.pool.post(timeout=deadline, timing=timing, cmd=cmd, **request)
+        except Exception as e:
+            return reply(failure(e))
+
+        # pass back the node side of the timing
+        response = { 'ok': True }
+        if isinstance(result, tuple):
+            result, response['profile'] = result
+        response['result'] = result
+        if timing is not None:
+            response['timing'] = { k: timing[k] for k in ('load', 'eval', 'svg', 'heap') if k in timing }
+        reply(response)
+
+    def _retain(self, digest, payload):
+        with self.lock:
+            if digest not in self.refs:
+                data_registry[digest] = RelayedData(digest, payload)
+                self.refs[digest] = 0
+            self.refs[digest] += 1
+
+    def _release(self, digest):
+        with self.lock:
+            self.refs[digest] -= 1
+            if self.refs[digest] > 0:
+                return
+            del self.refs[digest]
+            data_registry.pop(digest, None)
+        self.pool.drop(digest)
+
+def failure(error):
+    if isinstance(error, GumError):
+        return { 'ok': False, 'result': { 'error': error.error_type, 'message': error.error_message } }
+    return { 'ok': False, 'result': { 'error': GumErrorType.SERVER, 'message': str(error) } }
+
+def serve(path=None, workers=None):
+    import signal
+
+    # exit cleanly on terminate so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    daemon = GumSocketServer(path, workers)
+    daemon.listen()
+    print(f'[gum server] serving on {daemon.path} with {daemon.pool.size} workers', flush=True)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
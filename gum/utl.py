@@ -1,8 +1,15 @@
 ## utils
 
+import re
 import json
+import math
+import numbers
+import hashlib
 import inspect
-from collections import defaultdict
+import weakref
+import threading
+from contextvars import ContextVar
+from collections import OrderedDict, defaultdict, namedtuple
 
 from .gum import evaluate, display, snake_case
 
@@ -12,103 +19,272 @@ from .gum import evaluate, display, snake_case
 
 class AlgMixin:
     def __add__(self, other):
-        return type(self)(f'({self})+({other})')
+        return binary('+', self, other)
 
     def __radd__(self, other):
-        return type(self)(f'({other})+({self})')
+        return binary('+', other, self)
 
     def __sub__(self, other):
-        return type(self)(f'({self})-({other})')
+        return binary('-', self, other)
 
     def __rsub__(self, other):
-        return type(self)(f'({other})-({self})')
+        return binary('-', other, self)
 
     def __mul__(self, other):
-        return type(self)(f'({self})*({other})')
+        return binary('*', self, other)
 
     def __rmul__(self, other):
-        return type(self)(f'({other})*({self})')
+        return binary('*', other, self)
 
     def __truediv__(self, other):
-        return type(self)(f'({self})/({other})')
+        return binary('/', self, other)
 
     def __rtruediv__(self, other):
-        return type(self)(f'({other})/({self})')
+        return binary('/', other, self)
 
     def __pow__(self, other):
-        return type(self)(f'({self})**({other})')
+        return binary('**', self, other)
 
     def __rpow__(self, other):
-        return type(self)(f'({other})**({self})')
+        return binary('**', other, self)
 
     def __mod__(self, other):
-        return type(self)(f'({self})%({other})')
+        return binary('%', self, other)
 
     def __rmod__(self, other):
-        return type(self)(f'({other})%({self})')
+        return binary('%', other, self)
 
     def __eq__(self, other):
-        return type(self)(f'({self})==({other})')
+        return binary('==', self, other)
 
     def __req__(self, other):
-        return type(self)(f'({other})==({self})')
+        return binary('==', other, self)
 
     def __ne__(self, other):
-        return type(self)(f'({self})!=({other})')
+        return binary('!=', self, other)
 
     def __rne__(self, other):
-        return type(self)(f'({other})!=({self})')
+        return binary('!=', other, self)
 
     def __gt__(self, other):
-        return type(self)(f'({self})>({other})')
+        return binary('>', self, other)
 
     def __rgt__(self, other):
-        return type(self)(f'({other})>({self})')
+        return binary('>', other, self)
 
     def __ge__(self, other):
-        return type(self)(f'({self})>=({other})')
+        return binary('>=', self, other)
 
     def __rge__(self, other):
-        return type(self)(f'({other})>=({self})')
+        return binary('>=', other, self)
 
     def __lt__(self, other):
-        return type(self)(f'({self})<({other})')
+        return binary('<', self, other)
 
     def __rlt__(self, other):
-        return type(self)(f'({other})<({self})')
+        return binary('<', other, self)
 
     def __le__(self, other):
-        return type(self)(f'({self})<=({other})')
+        return binary('<=', self, other)
 
     def __rle__(self, other):
-        return type(self)(f'({other})<=({self})')
+        return binary('<=', other, self)
 
     def __and__(self, other):
-        return type(self)(f'({self})&&({other})')
+        return binary('&&', self, other)
 
     def __rand__(self, other):
-        return type(self)(f'({other})&&({self})')
+        return binary('&&', other, self)
 
     def __or__(self, other):
-        return type(self)(f'({self})||({other})')
+        return binary('||', self, other)
 
     def __ror__(self, other):
-        return type(self)(f'({other})||({self})')
+        return binary('||', other, self)
 
     def __xor__(self, other):
-        return type(self)(f'({self})^({other})')
+        return binary('^', self, other)
 
     def __rxor__(self, other):
-        return type(self)(f'({other})^({self})')
+        return binary('^', other, self)
 
     def __neg__(self):
-        return type(self)(f'-({self})')
+        return unary('-', self)
 
     def __pos__(self):
-        return type(self)(f'+({self})')
+        return unary('+', self)
 
     def __call__(self, *args):
-        return type(self)(f'({self})({", ".join([ stringify(a) for a in args ])})')
+        return Expr('call', self, *args)
+
+##
+## expressions
+##
+
+# binding strength of javascript operators
+PRECEDENCE = {
+    '||': 4,
+    '&&': 5,
+    '^': 7,
+    '==': 9,
+    '!=': 9,
+    '<': 10,
+    '<=': 10,
+    '>': 10,
+    '>=': 10,
+    '+': 12,
+    '-': 12,
+    '*': 13,
+    '/': 13,
+    '%': 13,
+    '**': 16,
+}
+UNARY = 15
+CALL = 17
+ATOM = 20
+
+# operators written without surrounding spaces
+TIGHT = { '*', '/', '%', '**' }
+
+# python equivalents for constant folding
+FOLDS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '**': lambda a, b: a ** b,
+}
+
+# calls that must never be merged
+IMPURE = { 'random', 'Math.random' }
+
+# identifiers, member chains, and plain numbers
+ATOMIC = re.compile(r'[A-Za-z_$][\w$.]*|(\d+\.?\d*|\.\d+)(e[+-]?\d+)?')
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def literal(value):
+    # unwrap numeric constants
+    if type(value) is Con and is_number(value.value):
+        return value.value
+    return value
+
+def huge_power(op, left, right):
+    # integer powers past the double range
+    if op != '**' or not (isinstance(left, int) and isinstance(right, int)):
+        return False
+    return right > 0 and abs(left) > 1 and left.bit_length() * right > 1024
+
+def binary(op, left, right):
+    left1, right1 = literal(left), literal(right)
+
+    # fold numeric constants, leaving js to handle complex or overflowing
+    # results, and huge integer powers that would take long to compute
+    if op in FOLDS and is_number(left1) and is_number(right1) and not huge_power(op, left1, right1):
+        try:
+            value = FOLDS[op](left1, right1)
+        except (ArithmeticError, ValueError):
+            value = None
+        if is_number(value) and (isinstance(value, int) or math.isfinite(value)):
+            return Con(value)
+
+    # drop multiplicative identities
+    if op in ('*', '/', '**') and is_number(right1) and right1 == 1:
+        return left
+    if op == '*' and is_number(left1) and left1 == 1:
+        return right
+
+    # build node
+    return Expr(op, left, right)
+
+def unary(op, value):
+    value1 = literal(value)
+    if is_number(value1):
+        return Con(-value1 if op == '-' else value1)
+    return Expr(op, value)
+
+def operand_text(value):
+    # floats keep full precision in expressions
+    if isinstance(value, float):
+        return repr(value)
+    return stringify(value)
+
+def leaf_precedence(text):
+    if ATOMIC.fullmatch(text):
+        return ATOM
+    elif text[:1] in ('-', '+') and ATOMIC.fullmatch(text[1:]):
+        return UNARY
+    else:
+        return 0
+
+def operand(value, emit):
+    if isinstance(value, Expr):
+        return emit(value)
+    text = str(value) if isinstance(value, (Con, Var)) else operand_text(value)
+    return text, leaf_precedence(text)
+
+def wrap(text, paren):
+    return f'({text})' if paren else text
+
+def render_expr(node, emit):
+    op, args = node.op, node.args
+    if op == 'call':
+        func, *params = args
+        ftext, fprec = operand(func, emit)
+        ptext = ', '.join([ operand(p, emit)[0] for p in params ])
+        return f'{wrap(ftext, fprec < CALL)}({ptext})', CALL
+    elif len(args) == 1:
+        text, prec = operand(args[0], emit)
+        return f'{op}{wrap(text, prec < CALL)}', UNARY
+    else:
+        prec = PRECEDENCE[op]
+        (ltext, lprec), (rtext, rprec) = [ operand(a, emit) for a in args ]
+        if op == '**':
+            # right associative and the base can't be a unary expression
+            lparen, rparen = lprec <= prec, rprec < prec
+        else:
+            lparen, rparen = lprec < prec, rprec <= prec
+        sep = op if op in TIGHT else f' {op} '
+        return f'{wrap(ltext, lparen)}{sep}{wrap(rtext, rparen)}', prec
+
+def emit_expr(node):
+    return node.key(), expr_precedence(node)
+
+def expr_precedence(node):
+    if node.op == 'call':
+        return CALL
+    elif len(node.args) == 1:
+        return UNARY
+    else:
+        return PRECEDENCE[node.op]
+
+def hoist(root):
+    # count structurally equal subexpressions, shared ones are visited once
+    counts = {}
+    def visit(node):
+        key = node.key()
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] == 1:
+            for a in node.args:
+                if isinstance(a, Expr):
+                    visit(a)
+    visit(root)
+
+    # bind repeated pure subexpressions to constants
+    names, defs = {}, []
+    def emit(node):
+        key = node.key()
+        if node is root or counts[key] < 2 or not node.pure():
+            return render_expr(node, emit)
+        if key not in names:
+            text, _ = render_expr(node, emit)
+            names[key] = f'_e{len(names)}'
+            defs.append(f'const {names[key]} = {text}')
+        return names[key], ATOM
+    body, _ = emit(root)
+
+    return defs, body
 
 ##
 ## values
@@ -121,30 +297,191 @@ class Var(AlgMixin):
 
     @classmethod
     def from_series(cls, s, name=None):
-        return cls(s.name or name, s)
+        return cls(s.name or name, s.to_numpy(copy=False))
 
     def __str__(self):
-        return self.name
+        scope = SCOPE.get()
+        if scope is None:
+            return self.name
+        return scope.names.get(id(self), self.name)
 
     def define(self):
-        return f'const {self.name} = {stringify(self.value)}'
+        return f'const {self} = {stringify(self.value)}'
+
+    def buffer(self):
+        return encode_array(self.value)
+
+    def digest(self):
+        return value_digest(self.value)
+
+class DataVar(Var):
+    # stored in the render server, figures send it by reference
+    def __init__(self, name, value):
+        super().__init__(name, value)
+        self._digest = value_digest(value)
+
+    def digest(self):
+        return self._digest
+
+    def buffer(self):
+        return { 'ref': self.name, 'digest': self._digest.hex() }
+
+    def upload(self):
+        data = encode_array(self.value)
+        if data is not None:
+            return { 'data': data }
+        value = self.value.tolist() if hasattr(self.value, 'tolist') else self.value
+        return { 'value': value }
 
 class Con(AlgMixin):
     def __init__(self, value):
         self.value = value
 
     def __str__(self):
-        return self.value
+        return self.value if isinstance(self.value, str) else operand_text(self.value)
+
+class Expr(Con):
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+        self._key = None
+        self._stamp = None
+        self._pure = None
+
+    @property
+    def value(self):
+        return str(self)
+
+    def key(self):
+        # canonical text, also used to spot repeated subexpressions
+        if self._key is None or self._stamp != stamp():
+            self._key, _ = render_expr(self, emit_expr)
+            self._stamp = stamp()
+        return self._key
+
+    def pure(self):
+        if self._pure is None:
+            impure = self.op == 'call' and str(self.args[0]) in IMPURE
+            self._pure = not impure and all(
+                a.pure() for a in self.args if isinstance(a, Expr)
+            )
+        return self._pure
+
+    def __str__(self):
+        return self.key()
 
 class Fun:
     def __init__(self, func):
         sig = inspect.signature(func)
         self.args = [ Con(p.name) for p in sig.parameters.values() ]
         self.ret = func(*self.args)
+        self._text = None
 
-    def __str__(self):
+    @classmethod
+    def trace(cls, func):
+        # reuse traces of the same code with the same captured values
+        key = trace_key(func)
+        if key is None:
+            return cls(func)
+        with trace_lock:
+            fun = trace_cache.get(key)
+            if fun is not None:
+                trace_cache.move_to_end(key)
+                return fun
+        fun = cls(func)
+        with trace_lock:
+            trace_cache[key] = fun
+            while len(trace_cache) > TRACE_CACHE_SIZE:
+                trace_cache.popitem(last=False)
+        return fun
+
+    def render(self):
         args = ', '.join([ str(a) for a in self.args ])
-        return f'({args}) => ({self.ret})'
+        if isinstance(self.ret, Expr):
+            defs, body = hoist(self.ret)
+            if len(defs) > 0:
+                return f'({args}) => {{ {"; ".join(defs)}; return {body}; }}'
+            return f'({args}) => {body}'
+        elif isinstance(self.ret, (Con, Var)):
+            return f'({args}) => {self.ret}'
+        return f'({args}) => ({stringify(self.ret)})'
+
+    def __str__(self):
+        if self._text is None or self._stamp != stamp():
+            self._text, self._stamp = self.render(), stamp()
+        return self._text
+
+# traced functions, bounded lru
+TRACE_CACHE_SIZE = 256
+trace_cache = OrderedDict()
+trace_lock = threading.Lock()
+
+class Ident:
+    # hash symbolic values by identity, they define __eq__ as an operator
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, Ident) and self.value is other.value
+
+class Untraceable(Exception):
+    pass
+
+def freeze(value, seen):
+    # functions we call are keyed on what they read in turn
+    if inspect.ismethod(value):
+        raise Untraceable
+    if inspect.isfunction(value):
+        if value.__code__ in seen:
+            return value.__code__
+        key = function_key(value, seen)
+        if key is None:
+            raise Untraceable
+        return key
+    if inspect.ismodule(value):
+        return value
+    if inspect.isbuiltin(value) and inspect.ismodule(value.__self__):
+        return value
+    if isinstance(value, AlgMixin):
+        return Ident(value)
+
+    # only values that can't change under us, anything else is keyed by
+    # identity and would go stale when mutated
+    if value is None or isinstance(value, (numbers.Number, str, bytes)):
+        return value
+    if type(value) is tuple:
+        return tuple(freeze(v, seen) for v in value)
+    raise Untraceable
+
+def function_key(func, seen):
+    # bound methods read their instance, which can change under us
+    code = getattr(func, '__code__', None)
+    if code is None or inspect.ismethod(func):
+        return None
+    seen = seen | { code }
+
+    # captured values and referenced globals
+    try:
+        cells = tuple(freeze(c.cell_contents, seen) for c in func.__closure__ or ())
+        glob = getattr(func, '__globals__', {})
+        names = tuple((n, freeze(glob[n], seen)) for n in code.co_names if n in glob)
+        defaults = freeze(func.__defaults__, seen)
+    except (ValueError, Untraceable): # empty cell or uncacheable callee
+        return None
+    return (code, cells, names, defaults)
+
+def trace_key(func):
+    key = function_key(func, frozenset())
+
+    # values must be hashable
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
 ##
 ## core elements
@@ -167,22 +504,260 @@ class DisplayMixin:
             print() # make it on a new line
             display(self)
 
+class ArgDict(dict):
+    # dict that invalidates its owner's serialization cache on mutation
+    def __init__(self, owner, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owner = weakref.ref(owner)
+
+    def _touch(self):
+        owner = self._owner()
+        if owner is not None:
+            owner.touch()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._touch()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._touch()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._touch()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._touch()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._touch()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._touch()
+        return result
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self._touch()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._touch()
+
+    def __reduce__(self):
+        # the owner link can't be pickled, copies are plain dicts
+        return dict, (dict(self),)
+
+# cached serialization of an element, its own lines with children left as
+# (memo, depth) references, the memos of everything feeding into it, and a
+# snapshot of its args and children, None if they can't be snapshotted
+Memo = namedtuple('Memo', [ 'stamp', 'kids', 'segments', 'digest', 'key' ])
+
+def value_key(value):
+    # snapshot that changes when the value does, even in place
+    if value is None or isinstance(value, (str, bytes, bool, int, float, complex)):
+        return value
+    value = unwrap(value)
+    if isinstance(value, (Element, AlgMixin)):
+        return Ident(value)
+    elif isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(value_key(v) for v in value))
+    elif isinstance(value, dict):
+        return ('dict', tuple((k, value_key(v)) for k, v in value.items()))
+    elif hasattr(value, 'dtype'):
+        return ('array', value_digest(value))
+    elif callable(value):
+        key = trace_key(value)
+        if key is None:
+            raise Untraceable
+        return key
+    raise Untraceable
+
+def memo_key(elem):
+    # args and children as they are now, None if something could change unseen
+    try:
+        return value_key(dict(elem.args)), value_key(list(getattr(elem, 'children', ())))
+    except Untraceable:
+        return None
+
+def nested_elements(value):
+    # elements in a value, looking into containers and nested figures
+    value = unwrap(value)
+    if isinstance(value, Element):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from nested_elements(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from nested_elements(v)
+
+def current_memo(elem, fresh):
+    # the memo if nothing below changed, each element checked once per walk
+    if id(elem) in fresh:
+        return fresh[id(elem)][0]
+    kids = [ current_memo(k, fresh) for k in elem.kids() ]
+    key = memo_key(elem)
+    memo = getattr(elem, '_memo', None)
+    if memo is not None and (
+        memo.stamp != stamp() or key is None or memo.key != key or
+        len(kids) != len(memo.kids) or any(a is not b for a, b in zip(kids, memo.kids))
+    ):
+        memo = None
+    fresh[id(elem)] = (memo, key)
+    return memo
+
+class MemoFrame:
+    # an element on the walk, replaying its memo or building a new one
+    def __init__(self, elem, memo, depth, rel):
+        self.elem = elem
+        self.memo = memo
+        self.rel = rel
+        self.tab = TAB * depth
+        self.depth = depth
+        if memo is not None:
+            self.segments = iter(memo.segments)
+        else:
+            self.segments = elem.segments()
+            self.record = []
+            self.hasher = hashlib.blake2b(digest_size=16)
+
+    def add_line(self, line):
+        if self.memo is None:
+            self.record.append(line)
+            self.hasher.update(f'{line}\n'.encode())
+
+    def add_child(self, memo, rel):
+        if self.memo is None:
+            self.record.append((memo, rel))
+            self.hasher.update(f'<{rel}>'.encode() + memo.digest)
+
+    def finish(self, fresh):
+        if self.memo is None:
+            kids = tuple(getattr(k, '_memo', None) for k in self.elem.kids())
+            key = fresh[id(self.elem)][1]
+            self.memo = Memo(stamp(), kids, tuple(self.record), self.hasher.digest(), key)
+            object.__setattr__(self.elem, '_memo', self.memo)
+            fresh[id(self.elem)] = (self.memo, key)
+        return self.memo
+
+def memo_lines(root, depth=0):
+    # lines at their final indentation, replaying current memos and building
+    # the rest as we go, so each line is produced once and nothing is copied
+    fresh = {}
+    stack = [ MemoFrame(root, current_memo(root, fresh), depth, 0) ]
+    while len(stack) > 0:
+        frame = stack[-1]
+        seg = next(frame.segments, None)
+        if seg is None:
+            stack.pop()
+            memo = frame.finish(fresh)
+            if len(stack) > 0:
+                stack[-1].add_child(memo, frame.rel)
+        elif isinstance(seg, str):
+            yield f'{frame.tab}{seg}'
+            frame.add_line(seg)
+        elif frame.elem is None or frame.memo is not None:
+            memo, rel = seg
+            stack.append(MemoFrame(None, memo, frame.depth + rel, rel))
+        else:
+            elem, rel = seg
+            stack.append(MemoFrame(elem, current_memo(elem, fresh), frame.depth + rel, rel))
+
+def scoped_lines(scope, lines):
+    # advance a line generator with the renames in effect
+    while True:
+        token = SCOPE.set(scope)
+        try:
+            line = next(lines, None)
+        finally:
+            SCOPE.reset(token)
+        if line is None:
+            return
+        yield line
+
 class Element(DisplayMixin):
     def __init__(self, tag, unary, **args):
         self.tag = tag
         self.unary = unary
         self.args = args
 
+    def __setattr__(self, name, value):
+        if name == 'args':
+            value = ArgDict(self, value)
+        super().__setattr__(name, value)
+        if not name.startswith('_'):
+            self.touch()
+
+    def touch(self):
+        super().__setattr__('_memo', None)
+
+    def __getstate__(self):
+        # copies and pickles start with a fresh cache and args of their own
+        state = { k: v for k, v in self.__dict__.items() if k != '_memo' }
+        state['args'] = dict(self.args)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def kids(self):
+        # elements whose serialization feeds into ours
+        yield from nested_elements(list(getattr(self, 'children', ())))
+        yield from nested_elements(list(self.args.values()))
+
+    def memo(self):
+        # current memo, building whatever changed
+        memo = current_memo(self, {})
+        if memo is None:
+            for _ in memo_lines(self):
+                pass
+            memo = self._memo
+        return memo
+
+    def digest(self):
+        return self.memo().digest.hex()
+
     def inner(self):
         return ''
 
-    def __str__(self):
+    def inner_segments(self, depth=0):
+        yield from indent_lines(self.inner(), depth)
+
+    def inner_lines(self, depth=0):
+        return expand_segments(self.inner_segments(depth))
+
+    def segments(self, depth=0):
+        # own lines, with child elements left as (element, depth) placeholders
         args = convert_args(self.args)
         if self.unary:
-            return f'<{self.tag} {args} />'
+            yield from indent_lines(f'<{self.tag} {args} />', depth)
         else:
-            inner = self.inner()
-            return f'<{self.tag} {args}>\n{inner}\n</{self.tag}>'
+            yield from indent_lines(f'<{self.tag} {args}>', depth)
+            yield from self.inner_segments(depth)
+            yield f'{TAB * depth}</{self.tag}>'
+
+    def lines(self, depth=0):
+        # each line is emitted once at its final indentation
+        yield from memo_lines(self, depth)
+
+    def chunks(self, depth=0):
+        return join_lines(self.lines(depth))
+
+    def write(self, fp, depth=0):
+        for chunk in self.chunks(depth):
+            fp.write(chunk)
+
+    def __str__(self):
+        return '\n'.join(self.lines())
 
 class Group(Element):
     def __init__(self, *children, tag='Group', **args):
@@ -191,7 +766,11 @@ class Group(Element):
         self.children = children
 
     def inner(self):
-        return '\n'.join([ indented(convert_child(c)) for c in self.children ])
+        return '\n'.join(self.inner_lines())
+
+    def inner_segments(self, depth=0):
+        for c in self.children:
+            yield from child_segments(c, depth + 1)
 
 class DataGroup(Element):
     def __init__(self, *children, tag='Group', **args):
@@ -208,16 +787,113 @@ class RawGroup(Element):
         self.children = children
 
     def inner(self):
-        return '\n'.join([ indented(convert_child(c, raw=True)) for c in self.children ])
+        return '\n'.join(self.inner_lines())
+
+    def inner_segments(self, depth=0):
+        for c in self.children:
+            yield from child_segments(c, depth + 1, raw=True)
 
 ##
 ## converters
 ##
 
-def stringify(value):
+# significant digits for floats
+PRECISION = 6
+
+# bumped when global formatting changes to invalidate cached serializations
+EPOCH = 0
+
+# elements formatted per chunk for arrays
+ARRAY_CHUNK = 65536
+
+def set_precision(digits=6):
+    global PRECISION, EPOCH
+    PRECISION = digits
+    EPOCH += 1
+
+# variable renames in effect while a figure serializes, see Gum.resolve
+SCOPE = ContextVar('SCOPE', default=None)
+
+class Scope:
+    def __init__(self, names):
+        self.names = names
+        self.key = tuple(sorted(names.items()))
+
+def stamp():
+    # cached text is valid for the formatting epoch and active renames
+    scope = SCOPE.get()
+    return EPOCH if scope is None else (EPOCH, scope.key)
+
+def as_array(value):
+    # underlying numpy array, pandas data and memmaps aren't copied
+    import numpy as np
+    if hasattr(value, 'to_numpy'):
+        return value.to_numpy(copy=False)
+    return np.asarray(value)
+
+def value_digest(value):
+    # content hash, raw bytes for numeric arrays and serialized text otherwise
+    import numpy as np
+    hasher = hashlib.blake2b(digest_size=16)
+    array = value.to_numpy(copy=False) if hasattr(value, 'to_numpy') else value
+    if isinstance(array, np.ndarray) and array.dtype.kind in 'biufmM':
+        array = np.ascontiguousarray(array)
+        hasher.update(f'array:{array.dtype.str}:{array.shape}:'.encode())
+        hasher.update(array.reshape(-1).view(np.uint8))
+    else:
+        hasher.update(f'text:{stringify(value)}'.encode())
+    return hasher.digest()
+
+def stringify_array(value, precision):
+    # get underlying array
+    import numpy as np
+    array = as_array(value)
+
+    # pick element format
+    kind = array.dtype.kind
+    if kind == 'f':
+        fmt = f'%.{precision}g'
+    elif kind in 'iu':
+        fmt = '%d'
+    elif kind == 'b':
+        fmt = '%s'
+        array = np.where(array, 'true', 'false')
+    else:
+        return None
+
+    # pick row format
+    if array.ndim == 1:
+        item, width = fmt, 1
+    elif array.ndim == 2:
+        item, width = f'[{", ".join([ fmt ] * array.shape[1])}]', array.shape[1]
+    else:
+        return None
+
+    # format rows in chunks
+    flat = array.ravel()
+    step = max(1, ARRAY_CHUNK // max(1, width))
+    template = ', '.join([ item ] * step)
+    chunks = []
+    for i in range(0, len(array), step):
+        part = flat[i*width:(i+step)*width].tolist()
+        nrows = len(part) // width if width > 0 else min(step, len(array) - i)
+        form = template if nrows == step else ', '.join([ item ] * nrows)
+        chunks.append(form % tuple(part))
+    return f'[{", ".join(chunks)}]'
+
+def stringify(value, precision=None):
+    if precision is None:
+        precision = PRECISION
+
     # convert functions to Functions
     if callable(value) and not isinstance(value, AlgMixin):
-        value = Fun(value)
+        value = Fun.trace(value)
+
+    # fast path for numpy and pandas arrays
+    if hasattr(value, 'dtype') and getattr(value, 'ndim', 0) > 0:
+        text = stringify_array(value, precision)
+        if text is not None:
+            return text
 
     # convert numeric values to lists
     if hasattr(value, 'tolist'):
@@ -235,16 +911,57 @@ def stringify(value):
     elif isinstance(value, int):
         return str(value)
     elif isinstance(value, float):
-        return f'{value:g}'
+        return f'{value:.{precision}g}'
     elif isinstance(value, str):
         return json.dumps(value) # handles escaping
     elif isinstance(value, (list, tuple)):
-        return f'[{", ".join([ stringify(v) for v in value ])}]'
+        return f'[{", ".join([ stringify(v, precision) for v in value ])}]'
     elif isinstance(value, dict):
-        return f'{{ {", ".join([ f'"{k}": {stringify(v)}' for k, v in value.items() ])} }}'
+        items = ', '.join([ f'"{k}": {stringify(v, precision)}' for k, v in value.items() ])
+        return f'{{ {items} }}'
     else:
         raise ValueError(f'Unsupported type: {type(value)}')
 
+# little-endian wire types for numeric arrays
+BINARY_TYPES = {
+    'f64': '<f8',
+    'f32': '<f4',
+    'i32': '<i4',
+}
+
+INT32_RANGE = (-2**31, 2**31-1)
+
+def binary_dtype(array):
+    kind, size = array.dtype.kind, array.dtype.itemsize
+    if kind == 'f':
+        return 'f32' if size <= 4 else 'f64'
+    elif kind in 'iu':
+        if size < 4 or (kind == 'i' and size == 4):
+            return 'i32'
+        if len(array) == 0 or (array.min() >= INT32_RANGE[0] and array.max() <= INT32_RANGE[1]):
+            return 'i32'
+    return None
+
+def encode_array(value):
+    # only numpy-like arrays qualify
+    if not hasattr(value, 'dtype'):
+        return None
+
+    # get underlying array
+    import numpy as np
+    array = as_array(value)
+    if array.ndim != 1:
+        return None
+
+    # find wire type
+    dtype = binary_dtype(array)
+    if dtype is None:
+        return None
+
+    # raw little-endian values, the array itself when it already fits
+    array = np.ascontiguousarray(array, dtype=BINARY_TYPES[dtype])
+    return { 'dtype': dtype, 'data': array }
+
 def convert_argval(v):
     if isinstance(v, str):
         return f'"{v}"'
@@ -265,10 +982,46 @@ def convert_child(value, raw=False):
     else:
         return f'{{{enc}}}'
 
-def indented(text, n=2):
-    tab = n * ' '
-    lines = text.split('\n')
-    return '\n'.join([ f'{tab}{line}' for line in lines ])
+##
+## streaming
+##
+
+TAB = '  '
+
+def indent_lines(text, depth):
+    tab = TAB * depth
+    for line in text.split('\n'):
+        yield f'{tab}{line}'
+
+def unwrap(value):
+    # nested figures serialize as their content, the outer figure hoists their data
+    if hasattr(value, 'variables') and hasattr(value, 'content'):
+        return value.content
+    return value
+
+def child_segments(value, depth, raw=False):
+    value = unwrap(value)
+    if isinstance(value, Element):
+        yield value, depth
+    else:
+        yield from indent_lines(convert_child(value, raw=raw), depth)
+
+def expand_segments(segments):
+    for seg in segments:
+        if isinstance(seg, str):
+            yield seg
+        else:
+            elem, depth = seg
+            yield from elem.lines(depth)
+
+def join_lines(lines):
+    # pieces that concatenate to the newline-joined text
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+    for line in lines:
+        yield f'\n{line}'
 
 ##
 ## arg handlers
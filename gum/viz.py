@@ -2,7 +2,7 @@
 
 from itertools import cycle
 
-from .gen import C, GumData, Gum, SymPoints, SymLine, SymSpline, Plot, BarPlot, VBar
+from .gen import C, Var, GumData, Gum, SymPoints, SymLine, SymSpline, Plot, BarPlot, VBar, downsample_xy
 from .utl import prefix_split
 
 ##
@@ -69,7 +69,7 @@ def ensure_frame(data):
     import numpy as np
     import pandas as pd
     if isinstance(data, (np.ndarray, list, tuple)):
-        data = pd.DataFrame({ 'value': data })
+        data = pd.DataFrame({ 'value': data }, copy=False)
     elif isinstance(data, dict):
         data = pd.DataFrame({ k: ensure_series(v) for k, v in data.items() })
     elif isinstance(data, pd.Series):
@@ -78,27 +78,46 @@ def ensure_frame(data):
         raise ValueError(f'Unsupported type: {type(data)}')
     return data
 
-def lines(frame, spline=False, **kwargs):
+def downsample_frame(frame, method='auto', pixels=500):
+    import numpy as np
+
+    # each series gets its own thinned x values
+    xname = frame.index.name or 'index'
+    pairs = []
+    for i, col in enumerate(frame):
+        xvals, yvals = downsample_xy(frame.index, frame[col], method=method, pixels=pixels)
+        yname = frame[col].name or f'value_{i}'
+        pairs.append((Var(f'{xname}_{i}', np.asarray(xvals)), Var(yname, np.asarray(yvals))))
+    return pairs
+
+def lines(frame, spline=False, downsample=None, pixels=500, **kwargs):
     # collect arguments
     args = { **DEFAULT_PLOT, **kwargs }
     line_args, plot_args = prefix_split('line', args)
 
-    # convert to dataframe
-    frame = ensure_frame(frame)
-    data = GumData.from_frame(frame)
+    # get x/y pairs, thinning to about two points per pixel if asked
+    # stored datasets (GumData) are referenced as is unless thinned
+    if downsample is None:
+        data = frame if isinstance(frame, GumData) else GumData.from_frame(ensure_frame(frame))
+        pairs = [ (data.index, v) for v in data ]
+        vars = data
+    else:
+        frame = frame.to_frame() if isinstance(frame, GumData) else ensure_frame(frame)
+        pairs = downsample_frame(frame, method=downsample, pixels=pixels)
+        vars = [ v for pair in pairs for v in pair ]
 
     # get maker class
     Maker = SymSpline if spline else SymLine
 
     # data plotters
     lines = [
-        Maker(xvals=data.index, yvals=v, **{'stroke': c, **line_args})
-        for v, c in zip(data, cycle(COLORS))
+        Maker(xvals=x, yvals=y, **{'stroke': c, **line_args})
+        for (x, y), c in zip(pairs, cycle(COLORS))
     ]
 
     # generate svg code
     plot = Plot(*lines, **plot_args)
-    return Gum(plot, vars=data)
+    return Gum(plot, vars=vars)
 
 def points(frame, shape=None, **kwargs):
     # collect arguments
@@ -0,0 +1,260 @@
+# http render service
+
+import json
+import asyncio
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+
+from .gum import GumPool, GumError, GumErrorType, RenderCache, serialize, stats, new_timing
+from .utl import Group
+
+##
+## element trees
+##
+
+def element_tree(node):
+    # {"tag": ..., "props": {...}, "children": [...]} becomes an element
+    if isinstance(node, dict) and 'tag' in node:
+        props = { k: element_tree(v) for k, v in node.get('props', {}).items() }
+        children = [ element_tree(c) for c in node.get('children', []) ]
+        return Group(*children, tag=node['tag'], **props)
+    elif isinstance(node, list):
+        return [ element_tree(c) for c in node ]
+    return node
+
+##
+## http plumbing
+##
+
+STATUS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    422: 'Unprocessable Entity',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+# largest request body accepted
+MAX_BODY = 64 * 1024**2
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+        super().__init__(message)
+
+async def read_request(reader):
+    # request line, headers, then a content-length body
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'malformed request line')
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise HttpError(411, 'chunked bodies are not supported')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, 'bad content-length')
+    if length > MAX_BODY:
+        raise HttpError(413, f'body over {MAX_BODY} bytes')
+    body = await reader.readexactly(length)
+    return method, target, version, headers, body
+
+def write_response(writer, status, body=b'', headers=None, keep=True):
+    lines = [
+        f'HTTP/1.1 {status} {STATUS[status]}',
+        f'Content-Length: {len(body)}',
+        f'Connection: {"keep-alive" if keep else "close"}',
+        *[ f'{k}: {v}' for k, v in (headers or {}).items() ],
+    ]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    if len(body) > 0:
+        writer.write(body)
+
+def error_body(error, message):
+    return json.dumps({ 'error': error, 'message': message }).encode()
+
+##
+## render service
+##
+
+class GumHttpServer:
+    def __init__(self, workers=None, queue=64, timeout=30, cache=256):
+        self.pool = GumPool(workers)
+        self.queue = queue
+        self.timeout = timeout
+        self.cache = RenderCache(size=cache)
+        self.active = 0
+        self.rejected = 0
+        self.responses = Counter()
+
+    def capacity(self):
+        # one render per worker plus the waiting line
+        return self.pool.size + self.queue
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    method, target, version, headers, body = request
+                    keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                    status, rbody, rheaders = await self.route(method, target, headers, body)
+                except HttpError as e:
+                    # the stream may be out of sync, so hang up after
+                    status, rbody, rheaders = e.status, error_body('HTTP', e.message), { 'Content-Type': 'application/json' }
+                    keep = False
+                except Exception as e:
+                    status, rbody, rheaders = 500, error_body(GumErrorType.SERVER, str(e)), { 'Content-Type': 'application/json' }
+                    keep = False
+                self.responses[status] += 1
+                write_response(writer, status, rbody, rheaders, keep=keep)
+                await writer.drain()
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # client went away
+        finally:
+            writer.close()
+
+    async def route(self, method, target, headers, body):
+        url = urlsplit(target)
+        if url.path in ('/', '/render'):
+            if method != 'POST':
+                raise HttpError(405, 'use POST to render')
+            return await self.render(url.query, headers, body)
+        elif url.path == '/metrics':
+            return 200, self.metrics().encode(), { 'Content-Type': 'text/plain; version=0.0.4' }
+        elif url.path == '/health':
+            return 200, b'ok', { 'Content-Type': 'text/plain' }
+        raise HttpError(404, f'no route for {url.path}')
+
+    def parse(self, query, headers, body):
+        # jsx body with query options, or a json object of the same
+        params = { k: v[-1] for k, v in parse_qs(query).items() }
+        ctype = headers.get('content-type', '').split(';')[0].strip().lower()
+        try:
+            if ctype == 'application/json':
+                spec = json.loads(body)
+                if not isinstance(spec, dict):
+                    raise HttpError(400, 'expected a json object')
+                params.update(spec)
+            else:
+                params['code'] = body.decode('utf-8')
+            pixels = int(params.get('pixels', 500))
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HttpError(400, str(e))
+
+        # element trees go through the usual serializer
+        if 'element' in params:
+            code, data = serialize(element_tree(params['element']))
+        elif isinstance(params.get('code'), str) and len(params['code']) > 0:
+            code, data = params['code'], None
+        else:
+            raise HttpError(400, 'missing code or element')
+        return code, data, pixels, params.get('theme')
+
+    async def render(self, query, headers, body):
+        loop = asyncio.get_running_loop()
+        code, data, pixels, theme = await loop.run_in_executor(None, self.parse, query, headers, body)
+
+        # content hash doubles as the etag, so clients can skip the render
+        key = self.cache.key(code, data=data, size=pixels, theme=theme)
+        etag = f'"{key[:32]}"'
+        rheaders = { 'ETag': etag }
+        if headers.get('if-none-match') == etag:
+            return 304, b'', rheaders
+        rheaders['Content-Type'] = 'image/svg+xml'
+        svg = self.cache.get(key)
+        if svg is not None:
+            return 200, svg, rheaders
+
+        # shed load rather than queue without bound
+        if self.active >= self.capacity():
+            self.rejected += 1
+            return 503, error_body('BUSY', 'render queue is full'), { 'Content-Type': 'application/json', 'Retry-After': '1' }
+
+        self.active += 1
+        try:
+            svg = await self.evaluate(code, data, pixels, theme)
+        except GumError as e:
+            status = 504 if e.error_type == GumErrorType.TIMEOUT else 422
+            return status, error_body(e.error_type, e.error_message), { 'Content-Type': 'application/json' }
+        except Exception as e:
+            return 500, error_body(GumErrorType.SERVER, str(e)), { 'Content-Type': 'application/json' }
+        finally:
+            self.active -= 1
+        self.cache.put(key, svg)
+        return 200, svg, rheaders
+
+    async def evaluate(self, code, data, pixels, theme):
+        # pipe writes can block, so submit off the event loop
+        loop = asyncio.get_running_loop()
+        submit = lambda: self.pool.submit(timing=new_timing(), code=code, data=data, size=pixels, theme=theme)
+        future = await loop.run_in_executor(None, submit)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.pool.abort(future)
+            raise GumError(GumErrorType.TIMEOUT, f'render timed out after {self.timeout}s')
+
+    def metrics(self):
+        # prometheus text format
+        snap, info = stats(), self.cache.info()
+        lines = [
+            f'gum_renders_total {snap["count"]}',
+            f'gum_render_errors_total {snap["errors"]}',
+            f'gum_bytes_out_total {snap["bytes_out"]}',
+            f'gum_bytes_in_total {snap["bytes_in"]}',
+            f'gum_workers {len(self.pool)}',
+            f'gum_http_active {self.active}',
+            f'gum_http_queue_depth {max(0, self.active - self.pool.size)}',
+            f'gum_http_rejected_total {self.rejected}',
+            f'gum_cache_hits_total {info["hits"]}',
+            f'gum_cache_misses_total {info["misses"]}',
+        ]
+        if snap['heap'] is not None:
+            lines.append(f'gum_heap_bytes {snap["heap"]}')
+        for status, count in sorted(self.responses.items()):
+            lines.append(f'gum_http_responses_total{{code="{status}"}} {count}')
+        for stage, summary in snap['stages'].items():
+            for q in ('p50', 'p95', 'p99'):
+                lines.append(f'gum_render_seconds{{stage="{stage}",quantile="0.{q[1:]}"}} {summary[q]:.6f}')
+            lines.append(f'gum_render_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        for stage, summary in snap['startup'].items():
+            lines.append(f'gum_startup_seconds{{stage="{stage}",quantile="0.50"}} {summary["p50"]:.6f}')
+            lines.append(f'gum_startup_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.close()
+
+def serve_http(host='127.0.0.1', port=8080, workers=None, queue=64, timeout=30, cache=256):
+    service = GumHttpServer(workers=workers, queue=queue, timeout=timeout, cache=cache)
+    print(f'[gum server] listening on http://{host}:{port} with {service.pool.size} workers', flush=True)
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
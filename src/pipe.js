@@ -1,14 +1,25 @@
 // pipe server
 
-import readline from 'readline'
-import { stdout } from 'process'
+import { stdin, stdout } from 'process'
+import { performance } from 'perf_hooks'
+import { Session } from 'inspector/promises'
 
 import { ErrorNoCode, ErrorNoReturn, ErrorNoElement } from 'gum-jsx/error'
 import { evaluateGum } from 'gum-jsx/eval'
 
+// dataset missing from the registry
+class ErrorNoData extends Error {
+    constructor(name) {
+        super(`dataset not found: ${name}`)
+        this.name = name
+    }
+}
+
 function parseError(e) {
     const { message } = e
-    if (e instanceof ErrorNoCode) {
+    if (e instanceof ErrorNoData) {
+        return { error: 'NODATA', message }
+    } else if (e instanceof ErrorNoCode) {
         return { error: 'NOCODE', message }
     } else if (e instanceof ErrorNoReturn) {
         return { error: 'NORETURN', message }
@@ -18,20 +29,337 @@ function parseError(e) {
     return { error: 'PARSE', message }
 }
 
-// create readline interface
-const rl = readline.createInterface({ input: process.stdin })
+// typed array types for binary data
+const ARRAY_TYPES = {
+    f64: Float64Array,
+    f32: Float32Array,
+    i32: Int32Array,
+}
+
+// decode a little-endian binary buffer into an array
+function decodeArray({ dtype, data }) {
+    const Type = ARRAY_TYPES[dtype]
+    if (Type == null) throw new Error(`unknown dtype: ${dtype}`)
+    const bytes = (data.byteOffset % Type.BYTES_PER_ELEMENT == 0) ? data : new Uint8Array(data)
+    const array = new Type(bytes.buffer, bytes.byteOffset, bytes.byteLength / Type.BYTES_PER_ELEMENT)
+    return Array.from(array)
+}
 
-// handle lines from stdin
-rl.on('line', async (line) => {
-    const { code, ...args } = JSON.parse(line)
-    let message = null
+// decode request data, entries are buffers or registry references
+function decodeData(data) {
+    return Object.fromEntries(Object.entries(data).map(([ name, entry ]) => {
+        const value = (entry.ref != null) ? getData(entry) : decodeArray(entry)
+        return [ name, value ]
+    }))
+}
+
+// dataset registry, least recently used first
+const DATA_LIMIT = Number(process.env.GUM_DATA_LIMIT ?? 512 * 1024 ** 2)
+const datasets = new Map()
+let dataBytes = 0
+
+// store a dataset, returning the names evicted to make room
+function putData({ name, digest, data, value }) {
+    dropData({ name })
+    const array = (data != null) ? decodeArray(data) : value
+    const bytes = (data != null) ? 8 * array.length : 2 * JSON.stringify(value).length
+    datasets.set(name, { digest, array, bytes })
+    dataBytes += bytes
+    const evicted = []
+    for (const [ name1, entry ] of datasets) {
+        if (dataBytes <= DATA_LIMIT || name1 == name) break
+        datasets.delete(name1)
+        dataBytes -= entry.bytes
+        evicted.push(name1)
+    }
+    return evicted
+}
+
+function dropData({ name }) {
+    const entry = datasets.get(name)
+    if (entry != null) {
+        datasets.delete(name)
+        dataBytes -= entry.bytes
+    }
+    return entry != null
+}
+
+function getData({ ref, digest }) {
+    const entry = datasets.get(ref)
+    if (entry == null || entry.digest != digest) throw new ErrorNoData(ref)
+    datasets.delete(ref)
+    datasets.set(ref, entry)
+    return entry.array
+}
+
+// bind names globally for the duration of a call
+function withGlobals(vars, func) {
+    const saved = Object.keys(vars).map(name => [ name, Object.getOwnPropertyDescriptor(globalThis, name) ])
+    Object.assign(globalThis, vars)
     try {
+        return func()
+    } finally {
+        for (const [ name, desc ] of saved) {
+            if (desc == null) {
+                delete globalThis[name]
+            } else {
+                Object.defineProperty(globalThis, name, desc)
+            }
+        }
+    }
+}
+
+// stage timings in seconds, summed over batch items
+function newTiming() {
+    return { load: 0, eval: 0, svg: 0 }
+}
+
+function lap(timing, stage, start) {
+    const now = performance.now()
+    timing[stage] += (now - start) / 1000
+    return now
+}
+
+// evaluate code and return svg
+function evaluate({ code, data, ...args }, timing = newTiming()) {
+    let t = performance.now()
+    const vars = (data != null) ? decodeData(data) : {}
+    t = lap(timing, 'load', t)
+    return withGlobals(vars, () => {
         const elem = evaluateGum(code, args)
-        const result = elem.svg()
-        message = { ok: true, result }
+        t = lap(timing, 'eval', t)
+        const svg = elem.svg()
+        lap(timing, 'svg', t)
+        return svg
+    })
+}
+
+// evaluate many codes with shared args, errors are reported per item
+function evaluateMany({ items, ...args }, timing = newTiming()) {
+    return items.map(item => {
+        try {
+            const result = evaluate({ ...args, ...item }, timing)
+            return { ok: true, result }
+        } catch (e) {
+            const result = parseError(e)
+            return { ok: false, result }
+        }
+    })
+}
+
+// handle commands
+function dispatch({ cmd = 'eval', ...args }, timing) {
+    if (cmd == 'eval') {
+        return evaluate(args, timing)
+    } else if (cmd == 'batch') {
+        return evaluateMany(args, timing)
+    } else if (cmd == 'put') {
+        return putData(args)
+    } else if (cmd == 'drop') {
+        return dropData(args)
+    } else if (cmd == 'ping') {
+        return 'pong'
+    }
+    throw new Error(`unknown command: ${cmd}`)
+}
+
+// cpu profiler session, connected on first use
+const PROFILE_INTERVAL = 100 // microseconds
+let session = null
+
+// run a call under the cpu profiler, returning the .cpuprofile as well
+async function profiled(func) {
+    if (session == null) {
+        session = new Session()
+        session.connect()
+        await session.post('Profiler.enable')
+        await session.post('Profiler.setSamplingInterval', { interval: PROFILE_INTERVAL })
+    }
+    await session.post('Profiler.start')
+    let result
+    try {
+        result = func()
+    } catch (e) {
+        await session.post('Profiler.stop')
+        throw e
+    }
+    const { profile } = await session.post('Profiler.stop')
+    return { result, profile }
+}
+
+// replies are framed as two little-endian uint32 lengths, then a json
+// header, then string results as raw utf-8 so svgs skip json escaping
+function writeFrame(message) {
+    const bodies = []
+    const pack = (text) => {
+        const buf = Buffer.from(text, 'utf8')
+        bodies.push(buf)
+        return buf.length
+    }
+
+    // single string result goes whole, batch results as sized segments
+    const { result, ...header } = message
+    if (message.ok && typeof result == 'string') {
+        header.body = pack(result)
+    } else if (message.ok && Array.isArray(result) && result.some(r => r?.ok && typeof r.result == 'string')) {
+        header.result = result.map(r => (r.ok && typeof r.result == 'string') ? { ok: true, size: pack(r.result) } : r)
+    } else {
+        header.result = result
+    }
+
+    // assemble frame
+    const head = Buffer.from(JSON.stringify(header), 'utf8')
+    const size = bodies.reduce((n, b) => n + b.length, 0)
+    const prefix = Buffer.alloc(8)
+    prefix.writeUInt32LE(head.length, 0)
+    prefix.writeUInt32LE(size, 4)
+    stdout.write(Buffer.concat([ prefix, head, ...bodies ]))
+}
+
+// requests are a json line followed by any binary buffers it refers to,
+// each behind a little-endian uint64 byte length, so large arrays never
+// pass through a string
+const BUFFER_PREFIX = 8
+
+// data entries of a request, in the order the client packed them
+function dataEntries({ cmd = 'eval', data, items = [] }) {
+    if (cmd == 'put') return (data != null) ? [ data ] : []
+    return [ data, ...items.map(item => item.data) ].flatMap(d => Object.values(d ?? {}))
+}
+
+function attachBuffers(request, buffers) {
+    for (const entry of dataEntries(request)) {
+        if (entry?.buffer != null) {
+            entry.data = buffers[entry.buffer]
+            delete entry.buffer
+        }
+    }
+    return request
+}
+
+// split stdin into parsed requests, calling back with { request, error, load }
+function requestReader(onRequest) {
+    let parts = []          // pieces of the current line
+    let request = null      // parsed line waiting on its buffers
+    let load = 0
+    let count = 0
+    let buffers = []
+    let prefix = []         // pieces of the current length prefix
+    let target = null       // buffer being filled
+    let filled = 0
+
+    return (chunk) => {
+        let pos = 0
+        while (pos < chunk.length) {
+            if (request == null) {
+                // json line, possibly across many chunks
+                const end = chunk.indexOf(10, pos)
+                if (end < 0) {
+                    parts.push(chunk.subarray(pos))
+                    break
+                }
+                parts.push(chunk.subarray(pos, end))
+                pos = end + 1
+                const line = Buffer.concat(parts)
+                parts = []
+                const t = performance.now()
+                let parsed
+                try {
+                    parsed = JSON.parse(line.toString('utf8'))
+                } catch (error) {
+                    onRequest({ error })
+                    continue
+                }
+                load = (performance.now() - t) / 1000
+                const { buffers: count1 = 0, ...rest } = parsed
+                if (count1 == 0) {
+                    onRequest({ request: rest, load })
+                    continue
+                }
+                request = rest
+                count = count1
+                buffers = []
+            } else if (target == null) {
+                // length prefix, possibly split across chunks
+                const need = BUFFER_PREFIX - prefix.reduce((n, p) => n + p.length, 0)
+                prefix.push(chunk.subarray(pos, pos + need))
+                pos += prefix.at(-1).length
+                if (prefix.at(-1).length < need) break
+                const size = Number(Buffer.concat(prefix).readBigUInt64LE(0))
+                prefix = []
+                target = Buffer.allocUnsafeSlow(size)
+                filled = 0
+            } else {
+                // buffer body, copied once into place
+                const take = Math.min(target.length - filled, chunk.length - pos)
+                chunk.copy(target, filled, pos, pos + take)
+                filled += take
+                pos += take
+            }
+
+            // hand over the request once its last buffer is in
+            if (target != null && filled == target.length) {
+                buffers.push(target)
+                target = null
+                if (buffers.length == count) {
+                    onRequest({ request: attachBuffers(request, buffers), load })
+                    request = null
+                    buffers = []
+                }
+            }
+        }
+    }
+}
+
+// handle one request, echoing the request id in the reply
+async function handle({ request: parsed, error, load = 0 }) {
+    let id = null
+    let message = null
+    const timing = newTiming()
+    timing.load += load
+    try {
+        if (error != null) throw error
+        const { id: id1, profile = false, ...request } = parsed
+        id = id1
+        if (profile) {
+            const { result, profile } = await profiled(() => dispatch(request, timing))
+            message = { id, ok: true, result, profile }
+        } else {
+            const result = dispatch(request, timing)
+            message = { id, ok: true, result }
+        }
     } catch (e) {
         const result = parseError(e)
-        message = { ok: false, result }
+        message = { id, ok: false, result }
+    }
+    timing.heap = process.memoryUsage().heapUsed
+    writeFrame({ ...message, timing })
+}
+
+// small plot rendered at startup so fonts, text layout and hot paths are warm
+const WARMUP_CODE = `<Plot xlim={[0, 2*pi]} ylim={[-1, 1]} grid title="warmup" xlabel="x" ylabel="y">
+  <SymLine fy={sin} />
+</Plot>`
+
+// render the warm-up plot and report startup times, with a null id
+function warmup() {
+    const boot = performance.now() / 1000
+    let seconds = null
+    if (process.env.GUM_WARMUP != '0') {
+        const t = performance.now()
+        try {
+            evaluate({ code: WARMUP_CODE })
+            seconds = (performance.now() - t) / 1000
+        } catch (e) {
+            console.error(`warm-up render failed: ${e.message}`)
+        }
     }
-    stdout.write(JSON.stringify(message) + '\n')
-})
+    writeFrame({ id: null, ok: true, ready: true, result: null, timing: { boot, warmup: seconds } })
+}
+
+// requests are handled strictly in order, even across profiler awaits,
+// and queue up behind the warm-up render
+let queue = Promise.resolve().then(warmup)
+stdin.on('data', requestReader((parsed) => {
+    queue = queue.then(() => handle(parsed))
+}))
@@ -0,0 +1,55 @@
+## test harness: the real worker in front of a stub gum-jsx
+
+import os
+import shutil
+
+import pytest
+
+from gum import gum as G
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stand-in for gum-jsx, where markers in the code pick the behavior
+STUB_ERROR = '''\
+export class ErrorNoCode extends Error {}
+export class ErrorNoReturn extends Error {}
+export class ErrorNoElement extends Error {}
+'''
+
+STUB_EVAL = '''\
+import { ErrorNoCode } from './error.js'
+export function evaluateGum(code, args = {}) {
+    if (!code || code.trim() == '') throw new ErrorNoCode('no code')
+    if (code.includes('LOOP')) { while (true) {} }
+    if (code.includes('SLOW')) { const t = Date.now(); while (Date.now() - t < 200) {} }
+    if (code.includes('CRASH')) process.exit(1)
+    if (code.includes('BAD')) throw new Error('bad code')
+    return { svg: () => code }
+}
+'''
+
+STUB_PACKAGE = '{ "name": "gum-jsx", "type": "module", "exports": { "./error": "./error.js", "./eval": "./eval.js" } }'
+
+@pytest.fixture(scope='session', autouse=True)
+def stub_worker(tmp_path_factory):
+    # the worker resolves gum-jsx from node_modules next to it
+    if shutil.which('node') is None:
+        pytest.skip('node is not installed')
+    base = tmp_path_factory.mktemp('worker')
+    lib = base / 'node_modules' / 'gum-jsx'
+    lib.mkdir(parents=True)
+    (lib / 'error.js').write_text(STUB_ERROR)
+    (lib / 'eval.js').write_text(STUB_EVAL)
+    (lib / 'package.json').write_text(STUB_PACKAGE)
+    shutil.copy(os.path.join(ROOT, 'src', 'pipe.js'), base / 'pipe.js')
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(G, 'GUM_PATH', str(base / 'pipe.js'))
+        yield base
+
+@pytest.fixture
+def pipe():
+    pipe = G.GumUnixPipe()
+    pipe.init()
+    yield pipe
+    pipe.close()
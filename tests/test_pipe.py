@@ -0,0 +1,111 @@
+## worker pipe: pipelining, errors, timeouts, crashes, resends
+
+import time
+
+import numpy as np
+import pytest
+
+from gum import gum as G
+from gum.gum import GumError, GumErrorType
+from gum.utl import encode_array
+
+def test_ping(pipe):
+    assert pipe.ping() == 'pong'
+
+def test_pipelined(pipe):
+    # replies are matched to requests however many are in flight
+    futures = [ pipe.submit(code=f'ECHO {i}') for i in range(20) ]
+    results = [ bytes(pipe.wait(f, 5)).decode() for f in futures ]
+    assert results == [ f'ECHO {i}' for i in range(20) ]
+
+def test_error(pipe):
+    with pytest.raises(GumError) as info:
+        pipe.post(code='BAD', timeout=5)
+    assert info.value.error_type == GumErrorType.PARSE
+    assert bytes(pipe.post(code='ECHO after', timeout=5)) == b'ECHO after'
+
+def test_timeout(pipe):
+    # the hung worker is killed and the next request gets a fresh one
+    with pytest.raises(GumError) as info:
+        pipe.post(code='LOOP', timeout=0.5)
+    assert info.value.error_type == GumErrorType.TIMEOUT
+    assert bytes(pipe.post(code='ECHO after', timeout=5)) == b'ECHO after'
+
+def test_timeout_queued(pipe):
+    # requests queued behind a hung one are resent, not lost
+    hang = pipe.submit(code='LOOP')
+    after = pipe.submit(code='ECHO after')
+    with pytest.raises(GumError):
+        pipe.wait(hang, 0.5)
+    assert bytes(pipe.wait(after, 5)) == b'ECHO after'
+
+def test_crash(pipe):
+    # the request that crashed fails, the streamed one behind it is resent
+    def chunks():
+        yield 'ECHO'
+        for _ in range(1000):
+            yield ' x'
+    crash = pipe.submit(code='CRASH')
+    after = pipe.submit(code=chunks())
+    with pytest.raises(ValueError):
+        pipe.wait(crash, 5)
+    assert bytes(pipe.wait(after, 5)) == b'ECHO' + b' x' * 1000
+
+def test_binary_data(pipe):
+    # data buffers follow the request line as binary frames
+    data = { 'v': encode_array(np.arange(1000.0)), 'w': encode_array(np.arange(10)) }
+    assert bytes(pipe.post(code='ECHO data', data=data, timeout=5)) == b'ECHO data'
+
+def registered(name, value):
+    var = G.put_data(name, value)
+    return { 'ref': name, 'digest': var.digest().hex() }
+
+def test_nodata_resend(monkeypatch):
+    # a registry dataset evicted from the worker is uploaded again
+    monkeypatch.setenv('GUM_DATA_LIMIT', '100')
+    pipe = G.GumUnixPipe()
+    pipe.init()
+    try:
+        a = registered('A', np.arange(10.0))
+        for i in range(10):
+            b = registered('B', np.arange(10.0) + i)
+            assert bytes(pipe.post(code='ECHO b', data={ 'v': b }, timeout=5)) == b'ECHO b'
+            assert bytes(pipe.post(code='ECHO a', data={ 'v': a }, timeout=5)) == b'ECHO a'
+    finally:
+        pipe.close()
+        for name in ('A', 'B'):
+            G.data_registry.pop(name, None)
+
+def test_async_pipe():
+    import asyncio
+
+    async def run():
+        pipe = G.AsyncGumPipe()
+        try:
+            results = await asyncio.gather(*[ pipe.post(code=f'ECHO {i}', timeout=5) for i in range(10) ])
+            with pytest.raises(GumError):
+                await pipe.post(code='LOOP', timeout=0.5)
+            after = await pipe.post(code='ECHO after', timeout=5)
+        finally:
+            await pipe.close()
+        return results, after
+
+    results, after = asyncio.run(run())
+    assert [ bytes(r) for r in results ] == [ f'ECHO {i}'.encode() for i in range(10) ]
+    assert bytes(after) == b'ECHO after'
+
+def test_async_close_hung():
+    import asyncio
+
+    # a worker stuck in a render is killed rather than waited on
+    async def run():
+        pipe = G.AsyncGumPipe()
+        future = asyncio.ensure_future(pipe.post(code='LOOP'))
+        await asyncio.sleep(0.2)
+        t0 = time.perf_counter()
+        await pipe.close()
+        with pytest.raises(ValueError):
+            await future
+        return time.perf_counter() - t0
+
+    assert asyncio.run(run()) < 3
@@ -0,0 +1,53 @@
+## socket daemon: shared workers behind a unix socket
+
+import threading
+import time
+
+import pytest
+
+from gum.gum import GumError, GumErrorType
+from gum.srv import GumSocketServer, GumSocketClient
+
+@pytest.fixture
+def served(tmp_path):
+    server = GumSocketServer(str(tmp_path / 'gum.sock'), workers=2)
+    server.listen()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.close()
+    thread.join(5)
+
+def test_roundtrip(served):
+    client = GumSocketClient(served.path)
+    assert client.ping() == 'pong'
+    assert client.evaluate('ECHO hi') == 'ECHO hi'
+
+def test_errors(served):
+    client = GumSocketClient(served.path)
+    with pytest.raises(GumError) as info:
+        client.evaluate('BAD')
+    assert info.value.error_type == GumErrorType.PARSE
+    with pytest.raises(GumError) as info:
+        client.evaluate('LOOP', timeout=0.5)
+    assert info.value.error_type == GumErrorType.TIMEOUT
+    assert client.evaluate('ECHO after') == 'ECHO after'
+
+def test_concurrent(served):
+    # renders in flight together come back to the right futures
+    client = GumSocketClient(served.path)
+    futures = [ client.submit(code=f'SLOW {i}') for i in range(4) ]
+    assert [ bytes(f.result(5)) for f in futures ] == [ f'SLOW {i}'.encode() for i in range(4) ]
+
+def test_close(served):
+    # renders in flight fail cleanly when the server goes away
+    client = GumSocketClient(served.path)
+    futures = [ client.submit(code='SLOW') for _ in range(3) ]
+    time.sleep(0.05)
+    served.close()
+    for future in futures:
+        with pytest.raises(GumError) as info:
+            future.result(5)
+        assert info.value.error_type == GumErrorType.SERVER
+    with pytest.raises(GumError):
+        client.ping()